@@ -1,71 +1,330 @@
-import funclib
-import pandas as pd
+from collections import OrderedDict
+from contextlib import nullcontext, redirect_stdout
+from copy import deepcopy
+from typing import Callable, List, NamedTuple, Optional, Tuple
+import importlib
 import re
-import pyreadstat
-from util import *
+import sys
+import time
+import weakref
+import console
+from console import find_top_level, print_red
+
+
+# command, shortest abbreviation Stata accepts, module defining it and
+# where it stores its results (r() or e()); a module is imported the first
+# time one of its commands runs, so commands that never touch data start
+# without pandas, pyreadstat or scipy
+COMMANDS = (
+    ('areg', 'areg', 'funclib', 'e'),
+    ('bootstrap', 'bootstrap', 'resample', 'e'),
+    ('compress', 'compress', 'funclib', None),
+    ('describe', 'd', 'funclib', 'r'),
+    ('do', 'do', 'session', None),
+    ('exit', 'exit', 'session', None),
+    ('jackknife', 'jackknife', 'resample', 'e'),
+    ('pwcorr', 'pwcorr', 'funclib', 'r'),
+    ('regress', 'reg', 'funclib', 'e'),
+    ('rolling', 'rolling', 'rolling', None),
+    ('save', 'sa', 'funclib', None),
+    ('set', 'set', 'session', None),
+    ('summarize', 'su', 'funclib', 'r'),
+    ('sysuse', 'sysuse', 'funclib', None),
+    ('timer', 'timer', 'session', 'r'),
+    ('use', 'use', 'funclib', None),
+)
+# every accepted spelling of a command, mapped to its full name
+COMMAND_NAMES = {name[:i]: name for name, abbreviation, _, _ in COMMANDS
+                 for i in range(len(abbreviation), len(name) + 1)}
+# synonyms Stata accepts besides abbreviations
+COMMAND_NAMES.update({'bs': 'bootstrap', 'bstrap': 'bootstrap', 'jknife': 'jackknife'})
+COMMAND_MODULES = {name: module for name, _, module, _ in COMMANDS}
+COMMAND_RESULTS = {name: results for name, _, _, results in COMMANDS}
+
+# command lines whose parse is kept for reuse
+PARSE_CACHE_SIZE = 1024
+# commands whose output and results depend only on the command line and
+# the data in memory, so that they are replayed while neither changes
+CACHED_COMMANDS = ('areg', 'pwcorr', 'regress', 'summarize')
+# runs of such commands are kept for replay up to about this many bytes
+# of results and output
+RESULT_CACHE_BYTES = 256 << 20
+
+PREFIX = re.compile(r'\s*(?:bysort|bys|by)\s')
+QUIETLY = re.compile(r'\s*(?:quietly|quietl|quiet|quie|qui)(?:\s*:|\s|$)')
+# a quoted string, a bracket or a comma on its own, or a run of anything else
+TOKEN = re.compile(r'"[^"]*"|[()\[\],]|[^\s"()\[\],]+|"')
+RANGE = re.compile(r'(\d+)/(\d+)')
+# prefixes that rerun the command after the colon on resampled data or on
+# windows of it
+REPLICATION = re.compile(r'\s*(?:bootstrap|bstrap|bs|jackknife|jknife|rolling)(?=[\s,:]|$)')
+
+
+class Command(NamedTuple):
+    by: Optional[List[str]]
+    command: str
+    args: List[str]
+    if_: Optional[str]
+    in_: Optional[Tuple[int, int]]
+    weight: Optional[str]
+    option: List[str]
+    quietly: bool = False
+    prefix: Optional['Command'] = None
+
+
+def split_words(text: str) -> List[Tuple[int, int]]:
+    """
+    Spans of the words of text in one scan: runs of characters separated by
+    blanks outside quotes and brackets, with a top-level comma and a
+    bracketed weight always words of their own
+    """
+    spans = []
+    depth = 0
+    closed = True
+    for tmp in TOKEN.finditer(text):
+        token = tmp.group()
+        if token == '"':
+            raise SyntaxError('unmatched quote')
+        if depth == 0 and (closed or tmp.start() != spans[-1][1] or token in (',', '[')):
+            spans.append([tmp.start(), tmp.end()])
+        else:
+            spans[-1][1] = tmp.end()
+        closed = False
+        if token in ('(', '['):
+            depth += 1
+        elif token in (')', ']'):
+            if depth == 0:
+                raise SyntaxError('too many \')\' or \']\'')
+            depth -= 1
+            closed = depth == 0 and token == ']'
+        elif token == ',' and depth == 0:
+            closed = True
+    if depth > 0:
+        raise SyntaxError('too few \')\' or \']\'')
+    return spans
+
+
+def parse_command(text: str) -> Command:
+    """
+    Split [quietly] [by varlist: | prefix [args] [, options]:] command [args]
+    [if exp] [in #/#] [weight] [, options]
+
+    The keywords if, in and using and the option comma are recognized only
+    as whole words outside quotes and parentheses, and an option keeps its
+    parenthesized argument, blanks included, as in vce(cluster id).
+    """
+    # parse 'quietly', before or after 'by'
+    quietly = False
+    tmp = QUIETLY.match(text)
+    if tmp is not None:
+        quietly = True
+        text = text[tmp.end():]
+    # parse 'by'
+    by = None
+    tmp = PREFIX.match(text)
+    if tmp is not None:
+        pos = find_top_level(text, ':')
+        if pos < 0:
+            raise SyntaxError('invalid syntax')
+        # groups are always formed in sorted order, so ', sort' adds nothing
+        by = text[tmp.end():pos].split(',')[0].split()
+        if not by:
+            raise SyntaxError('varlist required')
+        text = text[pos + 1:]
+        tmp = QUIETLY.match(text)
+        if tmp is not None:
+            quietly = True
+            text = text[tmp.end():]
+    # parse a replication or rolling prefix, itself parsed as a command
+    prefix = None
+    tmp = REPLICATION.match(text)
+    if tmp is not None:
+        pos = find_top_level(text, ':')
+        if pos < 0:
+            raise SyntaxError('%s is a prefix command; it must be followed by : and a command'
+                              % tmp.group().strip())
+        if by is not None:
+            raise SyntaxError('%s may not be combined with by' % tmp.group().strip())
+        prefix = parse_body(text[:pos])
+        text = text[pos + 1:]
+    return parse_body(text)._replace(by=by, quietly=quietly, prefix=prefix)
+
+
+def parse_body(text: str) -> Command:
+    """Split command [args] [if exp] [in #/#] [weight] [, options]"""
+    spans = split_words(text)
+    words = [text[a:b] for a, b in spans]
+    if len(words) == 0 or words[0] == ',':
+        raise SyntaxError('no command given')
+    args, option = [], []
+    _if, _in, weight = None, None, None
+    i = 1
+    while i < len(words):
+        word = words[i]
+        if word == ',':
+            option = words[i + 1:]
+            break
+        if word == 'if':
+            j = i + 1
+            while j < len(words) and words[j] not in (',', 'in', 'using') and not words[j].startswith('['):
+                j += 1
+            if _if is not None or j == i + 1:
+                raise SyntaxError('invalid syntax')
+            _if = text[spans[i + 1][0]:spans[j - 1][1]]
+            i = j
+            continue
+        if word == 'in':
+            tmp = RANGE.fullmatch(words[i + 1]) if i + 1 < len(words) else None
+            if _in is not None or tmp is None:
+                raise SyntaxError('invalid in range')
+            _in = (int(tmp.group(1)), int(tmp.group(2)))
+            i += 2
+            continue
+        if word.startswith('['):
+            if weight is not None or len(word) < 3 or not word.endswith(']'):
+                raise SyntaxError('invalid syntax')
+            weight = re.sub(r'\s', '', word[1:-1])
+        else:
+            args.append(word)
+        i += 1
+    return Command(None, words[0], args, _if, _in, weight, option)
+
+
+def unknown_command(parsed: Command) -> Optional[str]:
+    """The command or prefix of a parsed line that does not exist, if any"""
+    for name in (parsed.prefix.command if parsed.prefix is not None else None, parsed.command):
+        if name is not None and name not in COMMAND_NAMES:
+            return name
+    return None
+
+
+def results_of(parsed: Command) -> Optional[str]:
+    """Whether a parsed line stores its results in r() or e(), if either"""
+    return COMMAND_RESULTS[COMMAND_NAMES[(parsed.prefix or parsed).command]]
+
+
+def result_key(parsed: Command) -> Optional[tuple]:
+    """
+    Normalized form of a parsed line whose run may be replayed, with
+    abbreviations spelled out; None for a line that must always run
+    """
+    name = COMMAND_NAMES[parsed.command]
+    if parsed.prefix is not None or name not in CACHED_COMMANDS or 'using' in parsed.args:
+        return None
+    return (name, None if parsed.by is None else tuple(parsed.by), tuple(parsed.args),
+            parsed.if_, parsed.in_, parsed.weight, tuple(parsed.option))
+
+
+def run_nbytes(results: Optional[dict], output: Optional[str]) -> int:
+    """Approximate memory held by a kept run: its matrices, other results and output"""
+    nbytes = len(output or '')
+    for value in (results or {}).values():
+        if hasattr(value, 'memory_usage'):
+            nbytes += int(value.memory_usage(deep=True).sum())
+        else:
+            nbytes += getattr(value, 'nbytes', 64)
+    return nbytes
+
+
+class Tee:
+    """Stream writing through to another one and keeping what was written"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.parts = []
+
+    def write(self, text: str) -> int:
+        self.parts.append(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def getvalue(self) -> str:
+        return ''.join(self.parts)
 
 
 class StataInterpreter:
     def __init__(self):
-        pass
+        self.cache = OrderedDict()
 
     @staticmethod
     def getinput() -> str:
         return input('. ')
 
     @staticmethod
-    def parse(command: str) -> tuple:
-        # parse 'by'
-        tmp = re.search(r'by\s+(.+)\s*:', command)
-        if tmp is not None:
-            by = re.split(r'\s', tmp.group(1))
-            command = re.sub(r'by\s+(.+)\s*:', '', command)
-        else:
-            by = None
-        # parse 'option'
-        tmp = re.search(r',\s*(.+)', command)
-        if tmp is not None:
-            option = re.split(r'\s', tmp.group(1))
-            command = re.sub(r',\s*(.+)', '', command)
-        else:
-            option = []
-        # parse 'weight'
-        tmp = re.search(r'\[(.+)\]', command)
-        if tmp is not None:
-            weight = re.sub(r'\s', '', tmp.group(1))
-            command = re.sub(r'\[(.+)\]', '', command)
-        else:
-            weight = None
-        # parse 'in'
-        tmp = re.search(r'in\s+((\d+)/(\d+))', command)
-        if tmp is not None:
-            _in = (int(tmp.group(2)), int(tmp.group(3)))
-            command = re.sub(r'in\s+(\d+/\d+)', '', command)
-        else:
-            _in = None
-        # parse 'if'
-        tmp = re.search(r'if\s+(.+)', command)
-        if tmp is not None:
-            _if = tmp.group(1).strip()
-            command = re.sub(r'if\s+(.+)\s*', '', command)
+    def read_script(text: str) -> List[Tuple[int, str]]:
+        """
+        Commands of a do-file with their starting line numbers; comments are
+        dropped and lines ending in /// are joined to the next one
+        """
+        # blank out block comments but keep their newlines for line numbers
+        text = re.sub(r'/\*.*?\*/', lambda m: '\n' * m.group(0).count('\n'), text, flags=re.S)
+        commands = []
+        pending, start = '', None
+        for number, line in enumerate(text.splitlines(), 1):
+            if not pending and re.match(r'\s*\*', line):
+                continue
+            tmp = re.search(r'(^|\s)///', line)
+            if tmp is not None:
+                pending += line[:tmp.start()] + ' '
+                start = start or number
+                continue
+            line = pending + re.sub(r'(^|\s)//.*', '', line)
+            if line.strip():
+                commands.append((start or number, line.strip()))
+            pending, start = '', None
+        if pending.strip():
+            commands.append((start, pending.strip()))
+        return commands
+
+    def parse(self, command: str) -> Command:
+        """
+        Structured form of a command line, memoized by its text
+
+        Repeated lines, as in loops and generated do-files, are split only
+        once; every call returns its own copy of the list fields.
+        """
+        parsed = self.cache.get(command)
+        if parsed is None:
+            parsed = parse_command(command)
+            self.cache[command] = parsed
+            if len(self.cache) > PARSE_CACHE_SIZE:
+                self.cache.popitem(last=False)
         else:
-            _if = None
-        # parse 'command'
-        command = command.strip().split()
-        if len(command) == 0:
-            raise SyntaxError('no command given')
-        return by, command[0], command[1:], _if, _in, weight, option
+            self.cache.move_to_end(command)
+        return parsed._replace(by=None if parsed.by is None else list(parsed.by),
+                               args=list(parsed.args), option=list(parsed.option))
 
 
 class StataPlatform:
     def __init__(self):
-        self.data = pd.DataFrame()
-        self.meta = pyreadstat._readstat_parser.metadata_container()
+        self.handlers = {}
         self.macro = {}
         self.r = {}
+        self.e = {}
+        self.quietly = False
+        self.timers = {}
+        self.profiler = None
         self.globals = {}
         self.interpreter = StataInterpreter()
         self.program_to_be_exit = False
+        # bumped by every command that replaces or modifies the data
+        self.data_version = 0
+        self.result_cache = OrderedDict()
+        self.result_cache_bytes = 0
+
+    def __getattr__(self, name: str):
+        # the empty dataset is made on first use, so that a session which
+        # never loads data does not import pandas
+        if name == 'data':
+            import pandas as pd
+            self.data = pd.DataFrame()
+            return self.data
+        if name == 'meta':
+            import pyreadstat
+            self.meta = pyreadstat._readstat_parser.metadata_container()
+            return self.meta
+        raise AttributeError(name)
 
     def run(self):
         welcome = '''
@@ -81,31 +340,208 @@ ___/   /   /___/   /   /___/          Copyright 1985-2015 StataCorp LP
 '''
         print(welcome)
         while not self.program_to_be_exit:
-            command = self.interpreter.getinput()
+            text = self.interpreter.getinput()
+            start = time.perf_counter()
             try:
-                by, command, args, _if, _in, weight, option = self.interpreter.parse(command)
-                print('call %s(by=%s, args=%s, if=%s, in=%s, weight=%s, option=%s)' %
-                      (str(command), str(by), str(args), str(_if), str(_in), str(weight), str(option)))
+                parsed = self.interpreter.parse(text)
+                parse_time = time.perf_counter() - start
             except SyntaxError as e:
                 print_red(e.msg)
                 continue
-            try:
-                self.__getattribute__(command)
-            except AttributeError:
-                try:
-                    self.__setattr__(command, eval('funclib.' + command))
-                except AttributeError:
-                    print_red('no command named \'%s\'' % command)
-                    continue
+            if unknown_command(parsed) is not None:
+                print_red('no command named \'%s\'' % unknown_command(parsed))
+                continue
+            self.call(parsed, text=text, parse_time=parse_time)
+
+    def handler(self, command: str) -> Optional[Callable]:
+        """Function implementing a command or an abbreviation of one"""
+        name = COMMAND_NAMES.get(command)
+        if name is None:
+            return None
+        if name not in self.handlers:
+            module = importlib.import_module(COMMAND_MODULES[name])
+            self.handlers[name] = getattr(module, name)
+        return self.handlers[name]
+
+    def data_changed(self, changed: bool = True):
+        """
+        Start a new version of the data in memory, after a command replaced
+        or modified them; changed is whether they now differ from the file
+        they came from
+
+        Runs and missing-value masks cached for the old data are dropped,
+        so nothing replayed or reused can disagree with values since
+        changed in place.
+        """
+        import masks
+        self.data_version += 1
+        self.globals['data_has_been_changed'] = changed
+        self.forget_results()
+        masks.cache_clear()
+
+    def forget_results(self):
+        """Drop every run kept for replay"""
+        self.result_cache.clear()
+        self.result_cache_bytes = 0
+
+    def replay(self, key: tuple, results: Optional[str]) -> bool:
+        """
+        Restore the results, and show the output, of an earlier run of the
+        same line on the same version of the data, if one is cached
+        """
+        entry = self.result_cache.get((self.data_version,) + key)
+        # data assigned from outside keep the version; their identity is checked too
+        if entry is None or entry[0]() is not self.data or (entry[2] is None and not self.quietly):
+            return False
+        self.result_cache.move_to_end((self.data_version,) + key)
+        if results is not None:
+            setattr(self, results, deepcopy(entry[1]))
+        if not self.quietly:
+            sys.stdout.write(entry[2])
+        return True
+
+    def remember(self, key: tuple, results: Optional[str], output: Optional[str]):
+        stored = None if results is None else getattr(self, results)
+        nbytes = run_nbytes(stored, output)
+        if nbytes > RESULT_CACHE_BYTES:
+            return
+        key = (self.data_version,) + key
+        if key in self.result_cache:
+            self.result_cache_bytes -= self.result_cache.pop(key)[3]
+        self.result_cache[key] = (weakref.ref(self.data), deepcopy(stored), output, nbytes)
+        self.result_cache_bytes += nbytes
+        while self.result_cache_bytes > RESULT_CACHE_BYTES:
+            self.result_cache_bytes -= self.result_cache.popitem(last=False)[1][3]
+
+    def call(self, parsed: Command, text: Optional[str] = None, parse_time: float = 0.0) -> bool:
+        """Run a parsed line; whether it ran without reporting an error"""
+        by, command, args, _if, _in, weight, option, quietly, prefix = parsed
+        results = results_of(parsed)
+        if results is not None:
+            setattr(self, results, {})
+        # commands skip all formatting of their output when quietly is set
+        outer, self.quietly = self.quietly, self.quietly or quietly
+        key = result_key(parsed) if self.globals.get('resultcache', True) else None
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin(text or command, parse_time)
+        errors = console.reported_errors
+        try:
+            if key is not None and self.replay(key, results):
+                return True
+            # the output of a command that may be replayed is kept as it is shown
+            capture = Tee(sys.stdout) if key is not None and not self.quietly else None
             # try:
-            #     self.__dict__[command](self, args,
-            #                            by=by, _if=_if, _in=_in, weight=weight, option=option)
+            #     self.handler(command)(self, args,
+            #                           by=by, _if=_if, _in=_in, weight=weight, option=option)
             # except BaseException as e:
             #     print_red(e.args)
-            self.__dict__[command](self, args,
-                                   by=by, _if=_if, _in=_in, weight=weight, option=option)
+            if prefix is not None:
+                # the prefix runs the command itself, as often as it needs
+                self.handler(prefix.command)(self, prefix.args,
+                                             by=None, _if=prefix.if_, _in=prefix.in_, weight=prefix.weight,
+                                             option=prefix.option, command=parsed._replace(prefix=None))
+            else:
+                with redirect_stdout(capture) if capture is not None else nullcontext():
+                    self.handler(command)(self, args,
+                                          by=by, _if=_if, _in=_in, weight=weight, option=option)
+                # a failed run is not kept, so that its errors are reported again
+                if key is not None and console.reported_errors == errors:
+                    self.remember(key, results, None if capture is None else capture.getvalue())
+        finally:
+            self.quietly = outer
+            if profiler is not None:
+                profiler.end()
+        return console.reported_errors == errors
 
+    def execute(self, command: str, quietly: bool = True) -> dict:
+        """
+        Run one command and return what it stored in r() or e()
 
-if __name__ == '__main__':
+        By default nothing is formatted or printed except error messages;
+        a command storing no results returns an empty dict.
+        """
+        start = time.perf_counter()
+        parsed = self.interpreter.parse(command)
+        parse_time = time.perf_counter() - start
+        if unknown_command(parsed) is not None:
+            raise SyntaxError('unrecognized command:  %s' % unknown_command(parsed))
+        self.call(parsed._replace(quietly=parsed.quietly or quietly), command, parse_time)
+        results = results_of(parsed)
+        return {} if results is None else getattr(self, results)
+
+    def run_script(self, path: str, timings: Optional[str] = None) -> bool:
+        """
+        Run a do-file without prompting
+
+        The whole file is parsed before anything runs, so a syntax error or
+        an unknown command on any line stops the script up front; the first
+        command that reports an error ends it, and False is returned.  With
+        timings, the wall-clock seconds of every command are written to that
+        file as tab-separated line number, seconds and command.
+        """
+        try:
+            with open(path) as f:
+                commands = self.interpreter.read_script(f.read())
+        except OSError:
+            print_red('file %s not found' % path)
+            return False
+        parsed, errors = [], []
+        for number, command in commands:
+            start = time.perf_counter()
+            try:
+                parsed.append((number, command, self.interpreter.parse(command), time.perf_counter() - start))
+            except SyntaxError as e:
+                errors.append('%s, line %d: %s' % (path, number, e.msg))
+                continue
+            if unknown_command(parsed[-1][2]) is not None:
+                errors.append('%s, line %d: no command named \'%s\'' % (path, number, unknown_command(parsed[-1][2])))
+        for error in errors:
+            print_red(error)
+        if errors:
+            return False
+        log = open(timings, 'w') if timings is not None else None
+        try:
+            for number, command, tokens, parse_time in parsed:
+                if not self.quietly:
+                    print('. ' + command)
+                start = time.perf_counter()
+                succeeded = self.call(tokens, command, parse_time)
+                if log is not None:
+                    log.write('%d\t%.6f\t%s\n' % (number, time.perf_counter() - start, command))
+                    log.flush()
+                if not succeeded:
+                    # like Stata's do, the script ends at the first command that fails
+                    print_red('%s, line %d: end of do-file' % (path, number))
+                    return False
+                if not self.quietly:
+                    print()
+        finally:
+            if log is not None:
+                log.close()
+        return True
+
+
+def main(argv: List[str]):
+    """Run do-files given on the command line, or the interactive prompt"""
+    timings, profile = None, None
+    while len(argv) >= 2 and argv[0] in ('--timings', '--profile'):
+        if argv[0] == '--timings':
+            timings = argv[1]
+        else:
+            profile = argv[1]
+        argv = argv[2:]
     s = StataPlatform()
-    s.run()
+    if profile is not None:
+        from profiler import Profiler
+        s.profiler = Profiler(log=profile)
+    if not argv:
+        s.run()
+        return
+    for path in argv:
+        if not s.run_script(path, timings=timings):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,176 @@
+"""
+Scaling benchmarks of PyStata commands on synthetic datasets
+
+    python benchmark.py [--rows 1000,100000] [--vars 10,100] [--repeat 3]
+                        [--output results.json] [--save-baseline base.json]
+                        [--baseline base.json] [--tolerance 1.5]
+
+Every dataset of the rows x vars grid is generated once as a .dta file
+(y, a group variable g and normally distributed x1, x2, ..., with about 1%
+missing values) and every command is run through StataPlatform.execute,
+the same dispatch path as the prompt and do-files, with its output written
+to os.devnull.  After one untimed run, which pays for lazy imports, the
+reported time of a command is the fastest of --repeat runs; one further
+run with the profiler on gives its parse, preparation, compute and output
+split and its peak memory growth.
+
+With --baseline, the run fails (exit status 1) if any command takes more
+than --tolerance times its baseline time and at least --min-delta seconds
+longer.
+"""
+from contextlib import redirect_stdout
+from typing import List, Optional, Tuple
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from __init__ import StataPlatform
+from profiler import Profiler
+
+
+DEFAULT_ROWS = (1000, 10000, 100000, 1000000, 10000000)
+DEFAULT_VARS = (10, 100, 1000)
+# grid points with more values than this are skipped unless --max-cells
+# is raised; 1e8 doubles are 800 MB in memory
+MAX_CELLS = 10 ** 8
+MISSING_SHARE = 0.01
+
+
+def make_dataset(path: str, rows: int, vars: int, seed: int = 12345):
+    """Write a synthetic dataset of rows observations and vars variables"""
+    import numpy as np
+    import pandas as pd
+    import pyreadstat
+    rng = np.random.default_rng(seed)
+    k = vars - 2
+    X = rng.standard_normal((rows, k))
+    beta = rng.uniform(-1, 1, k)
+    data = {'y': X.dot(beta) + rng.standard_normal(rows)}
+    data['g'] = rng.integers(1, 11, rows).astype(np.int8)
+    for j in range(k):
+        column = X[:, j]
+        column[rng.random(rows) < MISSING_SHARE] = np.nan
+        data['x%d' % (j + 1)] = column
+    pyreadstat.write_dta(pd.DataFrame(data), path, file_label='synthetic %d x %d' % (rows, vars))
+
+
+def commands(path: str, vars: int) -> List[Tuple[str, str]]:
+    """Name under which each command is reported, and the command"""
+    xs = ' '.join('x%d' % (j + 1) for j in range(vars - 2))
+    return [
+        ('sysuse', 'sysuse %s, clear' % path),
+        ('describe using', 'describe using %s' % path),
+        ('describe', 'describe'),
+        ('summarize', 'summarize'),
+        ('summarize, detail', 'summarize, detail'),
+        ('by g: summarize y', 'by g: summarize y'),
+        ('pwcorr', 'pwcorr'),
+        ('regress', 'regress y %s' % xs),
+    ]
+
+
+def run_command(s: StataPlatform, command: str, repeat: int) -> dict:
+    import dataset
+    best = None
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        # a first, untimed run pays for lazy imports
+        s.execute(command, quietly=False)
+        for _ in range(repeat):
+            # every load decodes the file, not the in-process cache
+            dataset.cache_clear()
+            start = time.perf_counter()
+            s.execute(command, quietly=False)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        dataset.cache_clear()
+        s.profiler = Profiler()
+        try:
+            s.execute(command, quietly=False)
+        finally:
+            s.profiler.close()
+            record, s.profiler = s.profiler.records[-1], None
+    return {'seconds': best, 'parse': record['parse'], 'prep': record['prep'], 'compute': record['compute'],
+            'output': record['output'], 'peak_memory': record['peak_memory']}
+
+
+def key(result: dict) -> str:
+    return '%d x %d: %s' % (result['rows'], result['vars'], result['command'])
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float, min_delta: float) -> List[str]:
+    """Messages for every command slower than its baseline"""
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get(key(result))
+        if base is None:
+            continue
+        if result['seconds'] > base['seconds'] * tolerance and result['seconds'] - base['seconds'] >= min_delta:
+            regressions.append('%s: %.4fs, baseline %.4fs' % (key(result), result['seconds'], base['seconds']))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark PyStata commands on synthetic datasets')
+    parser.add_argument('--rows', default=','.join(map(str, DEFAULT_ROWS)),
+                        help='comma-separated numbers of observations')
+    parser.add_argument('--vars', default=','.join(map(str, DEFAULT_VARS)),
+                        help='comma-separated numbers of variables, at least 3')
+    parser.add_argument('--max-cells', type=int, default=MAX_CELLS,
+                        help='skip datasets with more than this many values')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'pystata-benchmark'),
+                        help='where the generated datasets are kept between runs')
+    parser.add_argument('--output', help='write the results here instead of to standard output')
+    parser.add_argument('--save-baseline', help='also write the results here as the new baseline')
+    parser.add_argument('--baseline', help='fail if a command is slower than in this earlier result file')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--min-delta', type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    for rows in map(int, args.rows.split(',')):
+        for vars in map(int, args.vars.split(',')):
+            if vars < 3 or rows * vars > args.max_cells:
+                continue
+            path = os.path.join(args.data_dir, 'bench_%d_%d.dta' % (rows, vars))
+            if not os.path.exists(path):
+                make_dataset(path, rows, vars)
+            s = StataPlatform()
+            # every run is timed, not replayed from the result cache
+            s.execute('set resultcache off')
+            for name, command in commands(path, vars):
+                result = {'rows': rows, 'vars': vars, 'command': name}
+                result.update(run_command(s, command, args.repeat))
+                results.append(result)
+                print('%-40s %10.4fs %14s bytes' % (key(result), result['seconds'],
+                                                   format(result['peak_memory'], ',')), file=sys.stderr)
+
+    report = {'python': platform.python_version(), 'machine': platform.machine(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance, args.min_delta)
+        for message in regressions:
+            print('regression: ' + message, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+from typing import List, Optional, Tuple
+
+
+# every spelling of a weight type, mapped to its full name
+WEIGHT_TYPES = {'fweight': 'fweight', 'fw': 'fweight', 'frequency': 'fweight',
+                'aweight': 'aweight', 'aw': 'aweight', 'cellsize': 'aweight',
+                'pweight': 'pweight', 'pw': 'pweight', 'iweight': 'iweight', 'iw': 'iweight'}
+
+
+# errors reported so far; a command failed if it reported any
+reported_errors = 0
+
+
+def print_red(message):
+    global reported_errors
+    reported_errors += 1
+    print('\033[1;31m' + repr(message) + '\033[0m')
+
+
+def find_top_level(text: str, char: str) -> int:
+    """Index of the first ``char`` outside parentheses and quotes, -1 if none"""
+    depth = 0
+    quoted = False
+    for i, c in enumerate(text):
+        if c == '"':
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == char and depth == 0:
+            return i
+    return -1
+
+
+def check_args(args: List[str]):
+    if args:
+        raise SyntaxError('%s not allowed' % args[0])
+
+
+def check_by(by: Optional[List[str]]):
+    if by is not None:
+        raise SyntaxError(' may not be combined with by')
+
+
+def check_if(_if: Optional[str]):
+    if _if is not None:
+        raise SyntaxError('if not allowed')
+
+
+def check_in(_in: Optional[Tuple[int, int]]):
+    if _in is not None:
+        raise SyntaxError('in range not allowed')
+
+
+def check_weight(weight: Optional[str]):
+    if weight is not None:
+        raise SyntaxError('weights not allowed')
+
+
+def parse_weight(weight: Optional[str], allowed: Tuple[str, ...]) -> Optional[Tuple[str, str]]:
+    """
+    Type and expression of [weight], checked against the types a command
+    allows; [weight=exp] means the first of them
+    """
+    if weight is None:
+        return None
+    kind, _, exp = weight.partition('=')
+    if not exp:
+        raise SyntaxError('invalid weight')
+    kind = allowed[0] if kind in ('w', 'weight') else WEIGHT_TYPES.get(kind)
+    if kind is None:
+        raise SyntaxError('invalid weight type')
+    if kind not in allowed:
+        raise SyntaxError('%ss not allowed' % kind)
+    return kind, exp
+
+
+def check_option(option: List[str]):
+    if option:
+        raise SyntaxError('option %s not allowed' % option[0])
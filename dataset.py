@@ -0,0 +1,261 @@
+from collections import OrderedDict
+from copy import deepcopy
+from typing import List, Optional, Tuple
+from pandas import DataFrame
+import hashlib
+import numpy as np
+import os
+import pickle
+import pyreadstat
+import shutil
+from expression import compile_expression, evaluate_if, is_numeric
+from util import FILE_TYPES, to_storage
+
+
+# extension of the memory-mapped columnar format written by save
+COLUMNAR = '.dtm'
+READ_ERRORS = (pyreadstat._readstat_parser.ReadstatError, pyreadstat._readstat_parser.PyreadstatError)
+
+# memory: recently read datasets and headers kept in process, up to
+#         memory_limit bytes
+# sidecar: also keep every fully read file as one .npy per column under
+#          sidecar_dir, reloaded memory-mapped instead of decoding the .dta
+settings = {
+    'memory_limit': 2 << 30,
+    'sidecar': False,
+    'sidecar_dir': os.path.join(os.path.expanduser('~'), '.pystata', 'cache'),
+}
+_memory = OrderedDict()
+_memory_bytes = 0
+
+
+def dta_path(name: str) -> str:
+    name = name.strip('"')
+    return name if name.endswith(('.dta', COLUMNAR)) else name + '.dta'
+
+
+def file_key(path: str) -> tuple:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise SyntaxError('file "%s" not found' % path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def frame_nbytes(data: DataFrame) -> int:
+    return int(data.memory_usage(index=False).sum())
+
+
+def cache_get(key: tuple) -> Optional[tuple]:
+    if key not in _memory:
+        return None
+    _memory.move_to_end(key)
+    data, meta, _ = _memory[key]
+    return (None if data is None else data.copy(deep=False)), deepcopy(meta)
+
+
+def cache_put(key: tuple, data: Optional[DataFrame], meta):
+    global _memory_bytes
+    nbytes = 0 if data is None else frame_nbytes(data)
+    if nbytes > settings['memory_limit']:
+        return
+    if key in _memory:
+        _memory_bytes -= _memory.pop(key)[2]
+    _memory[key] = (data, deepcopy(meta), nbytes)
+    _memory_bytes += nbytes
+    while _memory_bytes > settings['memory_limit']:
+        _memory_bytes -= _memory.popitem(last=False)[1][2]
+
+
+def cache_clear():
+    global _memory_bytes
+    _memory.clear()
+    _memory_bytes = 0
+
+
+def sidecar_dir(key: tuple) -> str:
+    name = hashlib.sha1(key[0].encode()).hexdigest()[:16]
+    return os.path.join(settings['sidecar_dir'], name, '%d-%d' % key[1:])
+
+
+def write_sidecar(key: tuple, data: DataFrame, meta):
+    target = sidecar_dir(key)
+    # older versions of the same file are stale once it has changed
+    shutil.rmtree(os.path.dirname(target), ignore_errors=True)
+    write_columns(target, data, meta)
+
+
+def read_sidecar(key: tuple, usecols: Optional[List[str]], row_offset: int, row_limit: int) -> Optional[tuple]:
+    try:
+        return read_columns(sidecar_dir(key), usecols, row_offset, row_limit)
+    except SyntaxError:
+        return None
+
+
+def write_columns(target: str, data: DataFrame, meta):
+    """
+    Store a dataset as a directory holding one .npy file per column and
+    the pickled header, so that it can be opened by memory-mapping
+    """
+    os.makedirs(target, exist_ok=True)
+    for i, var in enumerate(data.columns):
+        values = data[var]
+        if not is_numeric(values):
+            values = values.fillna('').astype(str).to_numpy(dtype=str)
+        elif values.dtype.kind == 'O':
+            values = values.to_numpy(dtype=float, na_value=np.nan)
+        else:
+            values = values.to_numpy()
+        np.save(os.path.join(target, '%d.npy' % i), values, allow_pickle=False)
+    with open(os.path.join(target, 'meta.pkl'), 'wb') as f:
+        pickle.dump((list(data.columns), meta), f)
+
+
+def read_columns(target: str, usecols: Optional[List[str]] = None,
+                 row_offset: int = 0, row_limit: int = 0) -> tuple:
+    """
+    Open a dataset written by write_columns; numeric columns are
+    memory-mapped views of their files, so nothing is read until used
+    """
+    try:
+        with open(os.path.join(target, 'meta.pkl'), 'rb') as f:
+            columns, meta = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        raise SyntaxError('file "%s" not found' % target)
+    stop = row_offset + row_limit if row_limit else None
+    data = {}
+    for i, var in enumerate(columns):
+        if usecols is None or var in usecols:
+            data[var] = np.load(os.path.join(target, '%d.npy' % i), mmap_mode='r')[row_offset:stop]
+    data = DataFrame(data, copy=False)
+    if usecols is not None:
+        restrict_meta(meta, list(data.columns))
+    meta.number_rows = data.shape[0]
+    return data, meta
+
+
+def narrow_types(data: DataFrame, meta) -> DataFrame:
+    """
+    Hold each numeric column in the dtype of its declared storage type;
+    readstat widens every byte, int, long and float to float64 or int64
+    """
+    columns = {}
+    for var in data.columns:
+        type = FILE_TYPES.get(meta.readstat_variable_types.get(var))
+        columns[var] = data[var] if type is None else to_storage(data[var], type)
+    return DataFrame(columns, copy=False)
+
+
+def restrict_meta(meta, columns: List[str]):
+    meta.column_names = columns
+    meta.column_labels = [meta.column_names_to_labels.get(var) for var in columns]
+    meta.number_columns = len(columns)
+
+
+def read_metadata(path: str):
+    """Header of a .dta file; none of its observations are decoded"""
+    if path.endswith(COLUMNAR):
+        data, meta = read_columns(path)
+        return data.iloc[0:0], meta
+    key = file_key(path) + ('header',)
+    cached = cache_get(key)
+    if cached is not None:
+        return DataFrame(columns=cached[1].column_names), cached[1]
+    try:
+        data, meta = pyreadstat.read_dta(path, metadataonly=True)
+    except READ_ERRORS:
+        raise SyntaxError('file "%s" not found' % path)
+    cache_put(key, None, meta)
+    return data, meta
+
+
+def load(path: str, usecols: Optional[List[str]], row_offset: int, row_limit: int) -> tuple:
+    if path.endswith(COLUMNAR):
+        return read_columns(path, usecols, row_offset, row_limit)
+    key = file_key(path)
+    request = key + (None if usecols is None else tuple(usecols), row_offset, row_limit)
+    cached = cache_get(request)
+    if cached is not None:
+        return cached
+    loaded = read_sidecar(key, usecols, row_offset, row_limit) if settings['sidecar'] else None
+    if loaded is None:
+        try:
+            data, meta = pyreadstat.read_dta(path, usecols=usecols, row_offset=row_offset, row_limit=row_limit)
+        except READ_ERRORS:
+            raise SyntaxError('file "%s" not found' % path)
+        loaded = narrow_types(data, meta), meta
+        if settings['sidecar'] and usecols is None and row_offset == 0 and row_limit == 0:
+            write_sidecar(key, *loaded)
+    cache_put(request, *loaded)
+    # the caller gets its own frame and meta, so changes made to them never
+    # reach the cached copy
+    return cache_get(request) or (loaded[0].copy(deep=False), deepcopy(loaded[1]))
+
+
+def read_dta(path: str, varlist: Optional[List[str]] = None, _if: Optional[str] = None,
+             _in: Optional[Tuple[int, int]] = None) -> tuple:
+    """
+    Read a .dta file, decoding only the observations in range and the
+    variables in varlist (plus those the if condition refers to)
+
+    Reads go through an in-process LRU keyed by path, size and modification
+    time and, when enabled, through the memory-mapped column sidecar.
+    """
+    usecols = None
+    if varlist or _if is not None:
+        empty, meta = read_metadata(path)
+        for var in varlist or []:
+            if var not in meta.column_names:
+                raise SyntaxError('variable %s not found' % var)
+        if varlist:
+            usecols = list(varlist)
+            if _if is not None:
+                usecols += compile_expression(_if, empty).variables
+            usecols = [var for var in meta.column_names if var in usecols]
+    row_offset, row_limit = (_in[0], _in[1] - _in[0]) if _in is not None else (0, 0)
+    if _in is not None and row_limit <= 0:
+        raise SyntaxError('no observations')
+    data, meta = load(path, usecols, row_offset, row_limit)
+    if _if is not None:
+        data = data[evaluate_if(_if, data)].reset_index(drop=True)
+        meta.number_rows = data.shape[0]
+    if varlist and _if is not None:
+        data = data[[var for var in data.columns if var in varlist]]
+        restrict_meta(meta, list(data.columns))
+    return data, meta
+
+
+def read_chunks(path: str, usecols: List[str], chunksize: int, row_offset: int = 0, row_limit: int = 0):
+    """Consecutive blocks of at most chunksize observations of a file"""
+    if path.endswith(COLUMNAR):
+        data, _ = read_columns(path, usecols, row_offset, row_limit)
+        for start in range(0, data.shape[0], chunksize):
+            yield data.iloc[start:start + chunksize]
+        return
+    # the reader does not stop at the limit by itself; rows still to read
+    # are counted here and the last chunk cut to them
+    remaining = row_limit if row_limit > 0 else None
+    if remaining is not None:
+        chunksize = min(chunksize, remaining)
+    for chunk, _ in pyreadstat.read_file_in_chunks(pyreadstat.read_dta, path, chunksize=chunksize,
+                                                    offset=row_offset, limit=row_limit, usecols=usecols):
+        if remaining is not None:
+            chunk = chunk.iloc[:remaining]
+            remaining -= chunk.shape[0]
+        if chunk.shape[0]:
+            yield chunk
+        if remaining == 0:
+            return
+
+
+def write_dta(path: str, data: DataFrame, meta):
+    if path.endswith(COLUMNAR):
+        shutil.rmtree(path, ignore_errors=True)
+        write_columns(path, data, meta)
+        return
+    pyreadstat.write_dta(data, path, file_label=getattr(meta, 'file_label', None) or '',
+                         column_labels=[(getattr(meta, 'column_names_to_labels', None) or {}).get(var) or ''
+                                        for var in data.columns],
+                         variable_value_labels={var: labels for var, labels in
+                                                (getattr(meta, 'variable_value_labels', None) or {}).items()
+                                                if var in data.columns})
@@ -0,0 +1,352 @@
+from collections import OrderedDict
+from functools import reduce
+from typing import Callable, List, Optional, Tuple, Union
+from pandas import DataFrame, Series
+from pandas.api.types import infer_dtype
+import numpy as np
+import re
+
+
+# compiled expressions kept for reuse, keyed by text and dataset schema
+CACHE_SIZE = 256
+_cache = OrderedDict()
+
+TOKEN = re.compile(r'''
+    \s*(?:
+      (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<missing>\.[a-z]?)
+    | (?P<string>"[^"]*")
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<op>==|!=|~=|>=|<=|[<>&|!~+\-*/^(),=])
+    )''', re.VERBOSE)
+
+COMPARISONS = {
+    '==': np.equal, '!=': np.not_equal, '~=': np.not_equal,
+    '>': np.greater, '<': np.less, '>=': np.greater_equal, '<=': np.less_equal,
+}
+
+MATH = {
+    'abs': np.abs, 'sqrt': np.sqrt, 'exp': np.exp, 'ln': np.log, 'log': np.log,
+    'log10': np.log10, 'floor': np.floor, 'ceil': np.ceil, 'int': np.trunc,
+}
+
+Value = Union[np.ndarray, float, str]
+
+
+def is_numeric(data: Series) -> bool:
+    if data.dtype.kind in 'biuf':
+        return True
+    # numeric columns with missing values may come back as object
+    return data.dtype.kind == 'O' and \
+        infer_dtype(data, skipna=True) in ('floating', 'integer', 'mixed-integer-float', 'empty')
+
+
+def numeric_values(data: Series) -> Optional[np.ndarray]:
+    """Float values of a numeric column, None for a string column"""
+    if not is_numeric(data):
+        return None
+    return data.to_numpy(dtype=float, na_value=np.nan)
+
+
+def is_string(value: Value) -> bool:
+    return isinstance(value, str) or (isinstance(value, np.ndarray) and value.dtype == object)
+
+
+def as_key(value: Value) -> Value:
+    # Stata orders missing above every number
+    if is_string(value):
+        return value
+    return np.where(np.isnan(value), np.inf, value)
+
+
+def truth(value: Value) -> Value:
+    # any nonzero value, missing included, is true
+    if is_string(value):
+        raise SyntaxError('type mismatch')
+    return np.not_equal(value, 0)
+
+
+def numeric(value: Value) -> Value:
+    if is_string(value):
+        raise SyntaxError('type mismatch')
+    return value
+
+
+class Expression:
+    """
+    A Stata expression compiled into a tree of vectorized closures
+
+    Every operator works on whole columns at once, so evaluating the
+    expression is a fixed number of NumPy passes over the data however many
+    observations there are.
+    """
+    def __init__(self, text: str, columns: List[str]):
+        self.text = text
+        self.columns = columns
+        self.variables = []
+        self.tokens = self.tokenize(text)
+        self.pos = 0
+        self.evaluate = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise SyntaxError('invalid syntax')
+
+    def __call__(self, data: DataFrame) -> Value:
+        return self.evaluate(data)
+
+    def mask(self, data: DataFrame) -> np.ndarray:
+        return np.broadcast_to(truth(self.evaluate(data)), (data.shape[0],))
+
+    @staticmethod
+    def tokenize(text: str) -> List[Tuple[str, str]]:
+        tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            result = TOKEN.match(text, pos)
+            if result is None or result.end() == pos:
+                raise SyntaxError('invalid syntax')
+            kind = result.lastgroup
+            tokens.append((kind, result.group(kind)))
+            pos = result.end()
+        return tokens
+
+    def peek(self) -> Optional[str]:
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos][1]
+        return None
+
+    def take(self) -> Tuple[str, str]:
+        if self.pos >= len(self.tokens):
+            raise SyntaxError('invalid syntax')
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def expect(self, token: str):
+        if self.take()[1] != token:
+            raise SyntaxError('invalid syntax')
+
+    def resolve(self, name: str) -> str:
+        if name in self.columns:
+            return name
+        matches = [column for column in self.columns if column.startswith(name)]
+        if len(matches) == 1:
+            return matches[0]
+        if len(matches) > 1:
+            raise SyntaxError('%s ambiguous abbreviation' % name)
+        raise SyntaxError('variable %s not found' % name)
+
+    # grammar, from the loosest operator to the tightest
+
+    def parse_or(self) -> Callable:
+        left = self.parse_and()
+        while self.peek() == '|':
+            self.take()
+            left = self.binary(left, self.parse_and(),
+                               lambda a, b: (truth(a) | truth(b)).astype(float))
+        return left
+
+    def parse_and(self) -> Callable:
+        left = self.parse_comparison()
+        while self.peek() == '&':
+            self.take()
+            left = self.binary(left, self.parse_comparison(),
+                               lambda a, b: (truth(a) & truth(b)).astype(float))
+        return left
+
+    def parse_comparison(self) -> Callable:
+        left = self.parse_sum()
+        while self.peek() in COMPARISONS:
+            func = COMPARISONS[self.take()[1]]
+            left = self.binary(left, self.parse_sum(), lambda a, b, func=func: compare(func, a, b))
+        if self.peek() == '=':
+            raise SyntaxError('= invalid; use ==')
+        return left
+
+    def parse_sum(self) -> Callable:
+        left = self.parse_product()
+        while self.peek() in ('+', '-'):
+            if self.take()[1] == '+':
+                left = self.binary(left, self.parse_product(), add)
+            else:
+                left = self.binary(left, self.parse_product(), lambda a, b: numeric(a) - numeric(b))
+        return left
+
+    def parse_product(self) -> Callable:
+        left = self.parse_negation()
+        while self.peek() in ('*', '/'):
+            if self.take()[1] == '*':
+                left = self.binary(left, self.parse_negation(), lambda a, b: numeric(a) * numeric(b))
+            else:
+                left = self.binary(left, self.parse_negation(), divide)
+        return left
+
+    def parse_negation(self) -> Callable:
+        if self.peek() == '-':
+            self.take()
+            operand = self.parse_negation()
+            return lambda data: -numeric(operand(data))
+        return self.parse_power()
+
+    def parse_power(self) -> Callable:
+        left = self.parse_not()
+        while self.peek() == '^':
+            self.take()
+            if self.peek() == '-':
+                self.take()
+                operand = self.parse_not()
+                right = lambda data, operand=operand: -numeric(operand(data))
+            else:
+                right = self.parse_not()
+            left = self.binary(left, right, power)
+        return left
+
+    def parse_not(self) -> Callable:
+        if self.peek() in ('!', '~'):
+            self.take()
+            operand = self.parse_not()
+            return lambda data: np.logical_not(truth(operand(data))).astype(float)
+        return self.parse_atom()
+
+    def parse_atom(self) -> Callable:
+        kind, token = self.take()
+        if kind == 'number':
+            value = float(token)
+            return lambda data: value
+        if kind == 'missing':
+            # .a to .z are read as plain NaN, so they could only ever match . itself
+            if token != '.':
+                raise SyntaxError('extended missing value %s not allowed' % token)
+            return lambda data: np.nan
+        if kind == 'string':
+            value = token[1:-1]
+            return lambda data: value
+        if token == '(':
+            inner = self.parse_or()
+            self.expect(')')
+            return inner
+        if kind != 'name':
+            raise SyntaxError('invalid syntax')
+        if self.peek() == '(':
+            return self.parse_function(token)
+        if token == '_n':
+            return lambda data: np.arange(1, data.shape[0] + 1, dtype=float)
+        if token == '_N':
+            return lambda data: float(data.shape[0])
+        name = self.resolve(token)
+        if name not in self.variables:
+            self.variables.append(name)
+        return lambda data: column(data[name])
+
+    def parse_function(self, name: str) -> Callable:
+        self.expect('(')
+        args = []
+        if self.peek() != ')':
+            args.append(self.parse_or())
+            while self.peek() == ',':
+                self.take()
+                args.append(self.parse_or())
+        self.expect(')')
+        if name in ('missing', 'mi'):
+            if not args:
+                raise SyntaxError('invalid syntax')
+            return lambda data: reduce(np.logical_or, [missing(arg(data)) for arg in args]).astype(float)
+        if name == 'inlist':
+            if len(args) < 2:
+                raise SyntaxError('invalid syntax')
+            return lambda data: inlist(*[arg(data) for arg in args])
+        if name == 'inrange':
+            if len(args) != 3:
+                raise SyntaxError('invalid syntax')
+            return lambda data: inrange(*[arg(data) for arg in args])
+        if name == 'round':
+            if len(args) not in (1, 2):
+                raise SyntaxError('invalid syntax')
+            return lambda data: stata_round(*[arg(data) for arg in args])
+        if name in MATH:
+            if len(args) != 1:
+                raise SyntaxError('invalid syntax')
+            func, arg = MATH[name], args[0]
+            return lambda data: apply(func, arg(data))
+        raise SyntaxError('unknown function %s()' % name)
+
+    @staticmethod
+    def binary(left: Callable, right: Callable, func: Callable) -> Callable:
+        return lambda data: func(left(data), right(data))
+
+
+def column(data: Series) -> np.ndarray:
+    values = numeric_values(data)
+    if values is None:
+        return data.fillna('').to_numpy(dtype=object)
+    return values
+
+
+def compare(func: Callable, a: Value, b: Value) -> Value:
+    if is_string(a) != is_string(b):
+        raise SyntaxError('type mismatch')
+    return func(as_key(a), as_key(b)).astype(float)
+
+
+def add(a: Value, b: Value) -> Value:
+    if is_string(a) != is_string(b):
+        raise SyntaxError('type mismatch')
+    return a + b
+
+
+def divide(a: Value, b: Value) -> Value:
+    a, b = numeric(a), numeric(b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(np.equal(b, 0), np.nan, np.true_divide(a, b))
+
+
+def power(a: Value, b: Value) -> Value:
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        return missing_if_infinite(np.power(numeric(a), numeric(b)))
+
+
+def apply(func: Callable, a: Value) -> Value:
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        return missing_if_infinite(func(numeric(a)))
+
+
+def missing_if_infinite(value: Value) -> Value:
+    return np.where(np.isinf(value), np.nan, value)
+
+
+def missing(value: Value) -> Value:
+    if is_string(value):
+        return np.equal(value, '')
+    return np.isnan(value)
+
+
+def inlist(z: Value, *values: Value) -> Value:
+    return reduce(np.logical_or, [compare(np.equal, z, value) for value in values]).astype(float)
+
+
+def inrange(z: Value, a: Value, b: Value) -> Value:
+    return (compare(np.greater_equal, z, a) * compare(np.less_equal, z, b)).astype(float)
+
+
+def stata_round(x: Value, y: Value = 1.0) -> Value:
+    x, y = numeric(x), numeric(y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.floor(np.true_divide(x, y) + 0.5) * y
+
+
+def compile_expression(text: str, data: DataFrame) -> Expression:
+    """Compiled form of ``text`` for datasets with the columns of ``data``"""
+    key = (text, tuple(data.columns), tuple(data.dtypes.astype(str)))
+    expression = _cache.get(key)
+    if expression is None:
+        expression = Expression(text, list(data.columns))
+        _cache[key] = expression
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    else:
+        _cache.move_to_end(key)
+    return expression
+
+
+def evaluate_if(text: str, data: DataFrame) -> np.ndarray:
+    """Boolean mask of the observations satisfying ``if text``"""
+    return compile_expression(text, data).mask(data)
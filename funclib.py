@@ -1,12 +1,19 @@
-from __init__ import StataPlatform
-from sys import exit as sysexit
-from sys import getsizeof
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import os
 import numpy as np
 import pandas as pd
-from scipy import stats
-import pyreadstat
+from dataset import dta_path, read_chunks, read_dta, read_metadata, write_dta
+from expression import column, compile_expression, missing
+from kernels import PERCENTILES, column_moments, column_summaries, order_statistics, pairwise_correlation
+from masks import observed
+from profiler import timed
+from regression import CrossProducts, Scores, absorbed_fit, absorbed_rank, demean, ols, robust_inference
 from util import *
 
+if TYPE_CHECKING:
+    from __init__ import StataPlatform
+
 
 def sysuse(self: StataPlatform, args: List[str],
            by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
@@ -24,10 +31,22 @@ Syntax
         sysuse ["]filename["] [, clear]
 
 
+    Use a subset of an example dataset
+
+        sysuse [varlist] [if] [in] using ["]filename["] [, clear]
+
+
     """
+    varlist = None
+
     def check_input():
+        nonlocal varlist
         # args
-        if len(args) > 1:
+        if 'using' in args:
+            if args.index('using') != len(args) - 2:
+                raise SyntaxError('invalid file specification')
+            varlist = args[:-2]
+        elif len(args) > 1:
             raise SyntaxError('invalid %s' % args[1])
         elif len(args) == 0:
             raise SyntaxError('invalid file specification')
@@ -35,8 +54,9 @@ Syntax
             check_by(by)
         except SyntaxError as e:
             raise SyntaxError('sysuse' + e.msg)
-        check_if(_if)
-        check_in(_in)
+        if varlist is None:
+            check_if(_if)
+            check_in(_in)
         check_weight(weight)
         # option
         if option:
@@ -51,11 +71,14 @@ Syntax
 
     def sysuse_file(dir: str):
         try:
-            self.data, self.meta = pyreadstat.read_dta(dir)
-            print('(' + self.meta.file_label + ')')
-            self.globals['dir'] = dir
-        except pyreadstat._readstat_parser.ReadstatError:
-            print_red('file \"%s\" not found' % dir)
+            self.data, self.meta = read_dta(dir, varlist, _if, _in)
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        self.data_changed(False)
+        if not self.quietly:
+            print('(' + (self.meta.file_label or '') + ')')
+        self.globals['dir'] = dir
 
     def main():
         try:
@@ -63,18 +86,154 @@ Syntax
         except SyntaxError as e:
             print_red(e.msg)
             return
-        dir = args[0]
+        dir = args[-1]
         if dir != 'dir':
-            dir = args[0].strip('\"')
-            if not dir.endswith('.dta'):
-                dir = dir + '.dta'
-            sysuse_file(dir)
+            sysuse_file(dta_path(dir))
         else:
             pass
 
     main()
 
 
+def use(self: StataPlatform, args: List[str],
+        by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+        weight: Optional[str], option: List[str]):
+    """
+Title
+
+    [D] use -- Load Stata dataset
+
+
+Syntax
+
+    Load Stata-format dataset
+
+        use filename [, clear]
+
+
+    Load subset of Stata-format dataset
+
+        use [varlist] [if] [in] using filename [, clear]
+
+
+    Only the variables in varlist and the observations in range are decoded
+    from the file.
+
+
+"""
+    varlist = None
+
+    def check_input():
+        nonlocal varlist
+        # args
+        if 'using' in args:
+            if args.index('using') != len(args) - 2:
+                raise SyntaxError('invalid file specification')
+            varlist = args[:-2]
+        elif len(args) > 1:
+            raise SyntaxError('invalid %s' % args[1])
+        elif len(args) == 0:
+            raise SyntaxError('invalid file specification')
+        try:
+            check_by(by)
+        except SyntaxError as e:
+            raise SyntaxError('use' + e.msg)
+        check_weight(weight)
+        # option
+        for i, opt in enumerate(option):
+            if i >= 1 or opt != 'clear':
+                raise SyntaxError('option %s not allowed' % opt)
+        if self.globals.get('data_has_been_changed') and len(option) == 0:
+            raise SyntaxError('no; data in memory would be lost')
+
+    def main():
+        try:
+            check_input()
+            dir = dta_path(args[-1])
+            self.data, self.meta = read_dta(dir, varlist, _if, _in)
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        self.data_changed(False)
+        if self.meta.file_label and not self.quietly:
+            print('(' + self.meta.file_label + ')')
+        self.globals['dir'] = dir
+
+    main()
+
+
+def compress(self: StataPlatform, args: List[str],
+             by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+             weight: Optional[str], option: List[str]):
+    """
+Title
+
+    [D] compress -- Compress data in memory
+
+
+Syntax
+
+        compress [varlist]
+
+
+    Each variable is stored in the smallest type that holds all of its
+    values exactly, and string variables in the width of their longest value.
+
+
+"""
+    def check_input():
+        try:
+            check_by(by)
+        except SyntaxError as e:
+            raise SyntaxError('compress' + e.msg)
+        check_if(_if)
+        check_in(_in)
+        check_weight(weight)
+        check_option(option)
+
+    def compress_string(var: str) -> Optional[str]:
+        lengths = self.data[var].str.len()
+        type = 'str%d' % max(int(lengths.max()) if lengths.notna().any() else 1, 1)
+        if type == storage_type(self.data[var], self.meta):
+            return None
+        # readstat counts the terminating null in string widths
+        self.meta.variable_storage_width[var] = int(type[3:]) + 1
+        return type
+
+    def compress_numeric(var: str) -> Optional[str]:
+        type = smallest_type(self.data[var])
+        if storage_width(type) >= storage_width(storage_type(self.data[var], self.meta)):
+            return None
+        self.data[var] = to_storage(self.data[var], type)
+        self.meta.readstat_variable_types[var] = READSTAT_TYPES[type]
+        return type
+
+    def main():
+        try:
+            check_input()
+            varlist = get_varlist(args, self.data)
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        types = {var: storage_type(self.data[var], self.meta) for var in varlist}
+        before = sum(column_nbytes(self.data[var], types[var]) for var in varlist)
+        for var in varlist:
+            if is_numeric(self.data[var]):
+                type = compress_numeric(var)
+            else:
+                type = compress_string(var)
+            if type is not None:
+                if not self.quietly:
+                    print('  variable %s was %s now %s' % (var, types[var], type))
+                types[var] = type
+                self.data_changed()
+        after = sum(column_nbytes(self.data[var], types[var]) for var in varlist)
+        if not self.quietly:
+            print('  (%s bytes saved)' % format(before - after, ','))
+
+    main()
+
+
 def describe(self: StataPlatform, args: List[str],
              by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
              weight: Optional[str], option: List[str]):
@@ -123,21 +282,24 @@ Syntax
             if item not in ['simple', 'short', 'fullnames', 'numbers']:
                 raise SyntaxError('option %s not allowed' % item)
 
+    @timed('output')
     def describe_simple(list: Iterable[str]):
         for i, var in enumerate(list):
             print(parse_varname(var, 12), end='  ')
             if i % 4 == 3:
                 print()
 
-    def describe_short(dir: str, data: pd.DataFrame, size: int, meta):
+    @timed('output')
+    def describe_short(dir: str, shape: Tuple[int, int], size: int, meta):
         print('Contains data from', dir)
-        print('obs:'.ljust(6, ' '), format(data.shape[0], ',').rjust(14, ' '),
-              ' ' * 18, meta.file_label, sep='')
-        print('vars:'.ljust(6, ' '), format(data.shape[1], ',').rjust(14, ' '), sep='')
+        print('obs:'.ljust(6, ' '), format(shape[0], ',').rjust(14, ' '),
+              ' ' * 18, meta.file_label or '', sep='')
+        print('vars:'.ljust(6, ' '), format(shape[1], ',').rjust(14, ' '), sep='')
         print('size:'.ljust(6, ' '), format(size, ',').rjust(14, ' '),
               ' ' * 18, np.where(len(meta.notes) != 0, '(_dta has notes)', ''), sep='')
 
-    def describe_main(data, meta, args, **kwargs):
+    @timed('output')
+    def describe_main(types: dict, meta, args, **kwargs):
         # head
         print('-' * 82)
         print('              storage    value')
@@ -154,37 +316,53 @@ Syntax
                     print('\n' + ' ' * 16, end='')
             else:
                 print(parse_varname(var, 15), end=' ')
-            print(np.array(data[var][0]).dtype.name.ljust(9, ' '),
+            print(types[var].ljust(9, ' '),
                   meta.variable_to_label.get(var, '').ljust(11, ' '),
-                  meta.column_labels[np.where(data.columns.values == var)[0][0]], sep='')
+                  meta.column_names_to_labels.get(var) or '', sep='')
         print('-' * 82)
 
+    def store_results(shape: Tuple[int, int], types: dict, changed: bool):
+        self.r = {'N': shape[0], 'k': shape[1],
+                  'width': sum(storage_width(t) for t in types.values()), 'changed': int(changed)}
+
     def describe_using(args, **kwargs):
+        # only the header is read; the data part of the file is never decoded
         try:
-            data, meta = pyreadstat.pyreadstat.read_dta(args[-1])
-            meta.dir = args[-1]
+            meta_dir = dta_path(args[-1])
+            data, meta = read_metadata(meta_dir)
+            meta.dir = meta_dir
             kwargs['using'] = True
-        except pyreadstat._readstat_parser.ReadstatError:
-            print_red('file \"%s\" not found' % args[-1])
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        vars = get_varlist(args[:-2], data)
+        types = file_storage_types(meta)
+        store_results((meta.number_rows, meta.number_columns), types, False)
+        if self.quietly:
             return
         if kwargs.get('simple'):
             describe_simple(data.columns)
             return
-        describe_short(meta.dir, data, getsizeof(data.values.copy()), meta)
+        describe_short(meta.dir, (meta.number_rows, meta.number_columns),
+                       meta.number_rows * self.r['width'], meta)
         if kwargs.get('short'):
             return
-        vars = get_varlist(args[:-2], data)
-        describe_main(data, meta, vars, **kwargs)
+        describe_main(types, meta, vars, **kwargs)
 
     def describe_(args, **kwargs):
+        vars = get_varlist(args, self.data)
+        types = {var: storage_type(self.data[var], self.meta) for var in self.data.columns}
+        store_results(self.data.shape, types, self.globals.get('data_has_been_changed', False))
+        if self.quietly:
+            return
         if kwargs.get('simple'):
             describe_simple(self.data.columns)
             return
-        describe_short(self.globals['dir'], self.data, getsizeof(self.data.values.copy()), self.meta)
+        size = sum(column_nbytes(self.data[var], types[var]) for var in self.data.columns)
+        describe_short(self.globals.get('dir', ''), self.data.shape, size, self.meta)
         if kwargs.get('short'):
             return
-        vars = get_varlist(args, self.data)
-        describe_main(self.data, self.meta, vars, **kwargs)
+        describe_main(types, self.meta, vars, **kwargs)
 
     def main():
         try:
@@ -206,42 +384,58 @@ Syntax
     main()
 
 
-def exit(self: StataPlatform, args: List[str],
+def save(self: StataPlatform, args: List[str],
          by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
          weight: Optional[str], option: List[str]):
     """
 Title
 
-    [R] exit -- Exit Stata
+    [D] save -- Save Stata dataset
 
 
 Syntax
 
-        exit [, clear]
+        save filename [, replace]
 
 
-"""
+    A filename ending in .dtm is saved in the columnar format: a directory
+    with one .npy file per variable, which use opens memory-mapped without
+    decoding anything.  Any other filename is saved as a .dta file.
 
+
+"""
     def check_input():
-        check_args(args)
-        check_by(by)
+        # args
+        if len(args) > 1:
+            raise SyntaxError('invalid %s' % args[1])
+        elif len(args) == 0:
+            raise SyntaxError('invalid file specification')
+        try:
+            check_by(by)
+        except SyntaxError as e:
+            raise SyntaxError('save' + e.msg)
         check_if(_if)
         check_in(_in)
         check_weight(weight)
         # option
-        for i, item in enumerate(option):
-            if item != 'clear' or i >= 1:
-                raise SyntaxError('option %s not allowed' % item)
-        if self.globals.get('data_has_been_changed') and len(option) == 0:
-            raise SyntaxError('no, data in memory would be lost')
+        for i, opt in enumerate(option):
+            if i >= 1 or opt != 'replace':
+                raise SyntaxError('option %s not allowed' % opt)
 
     def main():
         try:
             check_input()
+            dir = dta_path(args[0])
+            if os.path.exists(dir) and 'replace' not in option:
+                raise SyntaxError('file %s already exists' % dir)
         except SyntaxError as e:
             print_red(e.msg)
             return
-        sysexit(0)
+        write_dta(dir, self.data, self.meta)
+        if not self.quietly:
+            print('file %s saved' % dir)
+        self.globals['dir'] = dir
+        self.globals['data_has_been_changed'] = False
 
     main()
 
@@ -269,40 +463,83 @@ Syntax
     varlist may contain time-series operators; see tsvarlist.
     by, rolling, and statsby are allowed; see prefix.
 
-    aweights, fweights, and iweights are allowed.  However, iweights may not
-      be used with the detail option; see weight.
+    aweights and fweights are allowed; see weight.  Weighted statistics of
+      data collapsed to frequency weights are those of the expanded data.
 
 
 """
+    weighting = None
 
     def check_input():
+        nonlocal weighting
         for i, opt in enumerate(option):
-            if i >= 2 or re.search(opt, r'(detail|seperator\(\d+\))') is None:
+            if i >= 2 or re.fullmatch(r'detail|separator\((\d+)\)', opt) is None:
                 raise SyntaxError('option %s not allowed' % opt)
+        weighting = parse_weight(weight, ('aweight', 'fweight'))
+
+    def weights_of(data: pd.DataFrame) -> Tuple[Optional[np.ndarray], bool]:
+        """The weights of the observations, and whether they are frequency weights"""
+        if weighting is None:
+            return None, True
+        return weight_values(weighting, data), weighting[0] == 'fweight'
+
+    def store_results(obs, mean=None, stddev=None, _min=None, _max=None, sum_w=None, **detail):
+        # r() holds the statistics of the last variable (and group) shown
+        if obs == 0:
+            self.r = {'N': 0, 'sum_w': 0, 'sum': 0}
+            return
+        self.r = {'N': int(obs), 'sum_w': int(obs) if sum_w is None else sum_w, 'mean': mean,
+                  'Var': stddev ** 2, 'sd': stddev, 'min': _min, 'max': _max, 'sum': mean * obs}
+        self.r.update(detail)
 
     def summarize_detail(data, varlist):
-        def cal_descriptions(data: pd.Series):
-            obs = np.sum(np.logical_and(np.logical_not(list(map(lambda x: isinstance(x, str), data))),
-                                        np.logical_not(data == np.nan)))
-            if obs == 0:
-                return obs
-            percentiles = {str(percent) + '%': np.percentile(data, percent, interpolation='higher')
-                           for percent in [1, 5, 10, 25, 50, 75, 90, 95, 99]}
-            percentiles['50%'] = np.percentile(data, 50, interpolation='linear')
-            sorted_value = np.sort(data)
-            smallest = sorted_value[:4]
-            largest = sorted_value[-4:]
-            sum_of_wgt = None
-            mean = data.mean()
-            stddev = data.std()
-            variance = stddev ** 2
-            skew = stats.skew(data.values)
-            kurt = stats.kurtosis(data.values) + 3
-            return percentiles, smallest, largest, obs, sum_of_wgt, mean, stddev, variance, skew, kurt
-
-        for var in varlist:
-            vals = cal_descriptions(data[var])
-            print(self.meta.column_labels[np.where(data.columns.values == var)[0][0]].center(61, ' '))
+        def cal_descriptions(data: pd.DataFrame, varlist) -> list:
+            # one variable at a time, so no more than one column is ever
+            # converted or partitioned at once
+            weights, frequency = weights_of(data)
+            rets = {}
+            for var in varlist:
+                values = numeric_values(data[var])
+                if values is None:
+                    continue
+                X = values[:, None]
+                moments = column_moments(X, weights, frequency)
+                obs = moments['n'][0]
+                if obs == 0:
+                    continue
+                obs = int(round(obs))
+                order = order_statistics(X, weights=weights, frequency=frequency)[0]
+                percentiles = {str(percent) + '%': value for percent, value in order['percentiles'].items()}
+                smallest = np.pad(order['smallest'], (0, 4 - obs), constant_values=np.nan) \
+                    if obs < 4 else order['smallest']
+                largest = np.pad(order['largest'], (4 - obs, 0), constant_values=np.nan) \
+                    if obs < 4 else order['largest']
+                sum_of_wgt = moments['sum_w'][0]
+                mean = moments['mean'][0]
+                variance = moments['variance'][0]
+                stddev = np.sqrt(variance)
+                skew = moments['skewness'][0]
+                kurt = moments['kurtosis'][0]
+                rets[var] = percentiles, smallest, largest, obs, sum_of_wgt, mean, stddev, variance, skew, kurt
+            return [rets.get(var, 0) for var in varlist]
+
+        descriptions = cal_descriptions(data, varlist)
+        if descriptions:
+            vals = descriptions[-1]
+            if vals == 0:
+                store_results(0)
+            else:
+                store_results(vals[3], vals[5], vals[6], vals[1][0], vals[2][-1],
+                              sum_w=vals[4] if weighting is not None else None,
+                              skewness=vals[8], kurtosis=vals[9],
+                              **{'p%d' % percent: vals[0]['%d%%' % percent] for percent in PERCENTILES})
+        if not self.quietly:
+            display_detail(descriptions, varlist)
+
+    @timed('output')
+    def display_detail(descriptions: list, varlist):
+        for var, vals in zip(varlist, descriptions):
+            print((self.meta.column_names_to_labels.get(var) or var).center(61, ' '))
             print('-------------------------------------------------------------')
             if vals == 0:
                 print('no observations')
@@ -314,8 +551,8 @@ Syntax
                       (parse_number(vals[0]['5%']), parse_number(vals[1][1])))
                 print('10%%     %s       %s       Obs            %s' %
                       (parse_number(vals[0]['10%']), parse_number(vals[1][2]), parse_number(vals[3])))
-                print('25%%     %s       %s       Sum of Wgt.            ' %
-                      (parse_number(vals[0]['25%']), parse_number(vals[1][3])))
+                print('25%%     %s       %s       Sum of Wgt.    %s' %
+                      (parse_number(vals[0]['25%']), parse_number(vals[1][3]), parse_number(vals[4])))
                 print()
                 print('50%%     %s                      Mean           %s' %
                       (parse_number(vals[0]['50%']), parse_number(vals[5])))
@@ -331,27 +568,19 @@ Syntax
                       (parse_number(vals[0]['99%']), parse_number(vals[2][3]), parse_number(vals[9])))
             print()
 
-    def summarize_(data, varlist):
-        def cal_descriptions(data: pd.Series) -> tuple:
-            obs = np.sum(np.logical_and(np.logical_not(list(map(lambda x: isinstance(x, str), data))),
-                                        np.logical_not(data == np.nan)))
-            if obs == 0:
-                return obs, None, None, None, None
-            mean = data.mean()
-            stddev = data.std()
-            _min = data.min()
-            _max = data.max()
-            return obs, mean, stddev, _min, _max
-
+    @timed('output')
+    def print_table(rows: List[tuple], varlist):
         sep = 5
         for opt in option:
-            result = re.search(opt, r'seperator\((\d+\))')
-            if result:
+            result = re.fullmatch(r'detail|separator\((\d+)\)', opt)
+            if result and result.group(1) is not None:
                 sep = int(result.group(1))
+        if weighting is not None:
+            print_weighted_table(rows, varlist, sep)
+            return
         print('    Variable |        Obs        Mean    Std. Dev.       Min        Max')
         print('-------------+---------------------------------------------------------')
-        for i, var in enumerate(varlist):
-            vals = cal_descriptions(data[var])
+        for i, (var, vals) in enumerate(zip(varlist, rows)):
             print(parse_varname(var, 12, 'r'), '|', end='   ')
             print('%s' % parse_number(vals[0]), end='    ')
             if vals[0] != 0:
@@ -360,18 +589,110 @@ Syntax
                 print('%s' % parse_number(vals[3]), end='   ')
                 print('%s' % parse_number(vals[4]), end='')
             print()
-            if (i + 1) % sep == 0:
+            if sep and (i + 1) % sep == 0:
                 print('-------------+---------------------------------------------------------')
 
+    def print_weighted_table(rows: List[tuple], varlist, sep: int):
+        print('    Variable |     Obs      Weight        Mean   Std. Dev.       Min        Max')
+        print('-------------+-----------------------------------------------------------------')
+        for i, (var, vals) in enumerate(zip(varlist, rows)):
+            print(parse_varname(var, 12, 'r'), '|', end=' ')
+            print(format(int(vals[0]), ',').rjust(7), end='  ')
+            if vals[0] != 0:
+                print(parse_number(vals[5], length=10), end='    ')
+                print('%s' % parse_number(vals[1]), end='   ')
+                print('%s' % parse_number(vals[2]), end='   ')
+                print('%s' % parse_number(vals[3]), end='   ')
+                print('%s' % parse_number(vals[4]), end='')
+            print()
+            if sep and (i + 1) % sep == 0:
+                print('-------------+-----------------------------------------------------------------')
+
+    def summarize_(data, varlist):
+        def cal_descriptions(data: pd.DataFrame, varlist) -> list:
+            numeric = [var for var in varlist if is_numeric(data[var])]
+            weights, frequency = weights_of(data)
+            summaries = column_summaries(data[numeric], weights, frequency)
+            rets = {}
+            for j, var in enumerate(numeric):
+                rets[var] = (summaries['n'][j], summaries['mean'][j], np.sqrt(summaries['variance'][j]),
+                             summaries['min'][j], summaries['max'][j], summaries['sum_w'][j])
+            return [rets.get(var, (0, None, None, None, None, 0)) for var in varlist]
+
+        rows = cal_descriptions(data, varlist)
+        if rows:
+            store_results(*rows[-1][:5], sum_w=rows[-1][5] if weighting is not None else None)
+        if not self.quietly:
+            print_table(rows, varlist)
+
+    def summarize_by(groups: Groups, varlist):
+        weights, frequency = weights_of(groups.data)
+        if weights is not None:
+            weights = weights[groups.order]
+
+        def cal_descriptions(data: pd.Series) -> tuple:
+            # one bincount/reduceat per statistic covers every group at once
+            ngroups = len(groups)
+            values = numeric_values(data)
+            if values is None:
+                return (np.zeros(ngroups, dtype=int),) + (np.full(ngroups, np.nan),) * 4 + (np.zeros(ngroups),)
+            values = values[groups.order]
+            codes = groups.codes[groups.order]
+            valid = ~np.isnan(values)
+            if weights is None:
+                obs = np.bincount(codes, weights=valid, minlength=ngroups).astype(int)
+                sum_w = obs
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    mean = np.bincount(codes, weights=np.where(valid, values, 0), minlength=ngroups) / obs
+                    dev = np.where(valid, values - mean[codes], 0)
+                    stddev = np.sqrt(np.bincount(codes, weights=dev ** 2, minlength=ngroups) / (obs - 1))
+            else:
+                valid &= weights > 0
+                values = np.where(valid, values, np.nan)
+                w = np.where(valid, weights, 0)
+                sum_w = np.bincount(codes, weights=w, minlength=ngroups)
+                rows = np.bincount(codes, weights=valid, minlength=ngroups)
+                obs = np.rint(sum_w if frequency else rows).astype(int)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    mean = np.bincount(codes, weights=w * np.where(valid, values, 0), minlength=ngroups) / sum_w
+                    dev = np.where(valid, values - mean[codes], 0)
+                    m2 = np.bincount(codes, weights=w * dev ** 2, minlength=ngroups)
+                    stddev = np.sqrt(m2 / (sum_w - 1) if frequency else m2 / sum_w * rows / (rows - 1))
+            _min = np.fmin.reduceat(values, groups.bounds[:-1])
+            _max = np.fmax.reduceat(values, groups.bounds[:-1])
+            return obs, mean, stddev, _min, _max, sum_w
+
+        columns = [cal_descriptions(groups.data[var]) for var in varlist]
+        if columns and len(groups):
+            last = [stat[-1] for stat in columns[-1]]
+            store_results(*last[:5], sum_w=last[5] if weighting is not None else None)
+        if self.quietly:
+            return
+        for g in range(len(groups)):
+            print_by_header(groups.label(g, self.meta.variable_value_labels))
+            print_table([tuple(stat[g] for stat in column) for column in columns], varlist)
+
     def main():
         try:
             check_input()
             data = split_data(self.data, _in, _if, by)
-            varlist = get_varlist(args, data)
+            frame = data.data if isinstance(data, Groups) else data
+            varlist = get_varlist(args, frame)
+            columns = list(dict.fromkeys(list(varlist) + weight_variables(weighting, frame)))
+            if weighting is not None:
+                weight_values(weighting, frame)
         except SyntaxError as e:
             print_red(e.msg)
             return
-        if 'detail' in option:
+        if isinstance(data, Groups):
+            if 'detail' in option:
+                for g, group in data.slices(columns):
+                    if not self.quietly:
+                        print_by_header(data.label(g, self.meta.variable_value_labels))
+                    summarize_detail(group, varlist)
+            else:
+                summarize_by(data, varlist)
+        elif 'detail' in option:
             summarize_detail(data, varlist)
         else:
             summarize_(data, varlist)
@@ -392,69 +713,291 @@ Syntax
 
         regress depvar [indepvars] [if] [in] [weight] [, options]
 
+    Estimate from a file without loading it
+
+        regress depvar [indepvars] using filename [if] [in] [, options]
+
+
+    options           Description
+    -------------------------------------------------------------------------
+    noconstant        suppress constant term
+    absorb(varlist)   absorb the fixed effects of each variable in varlist
+    vce(vcetype)      vcetype may be ols, robust or cluster clustvar
+    chunksize(#)      read # observations of filename at a time; default is
+                        chunksize(100000)
+    -------------------------------------------------------------------------
+
+
+    vce(robust) gives heteroskedasticity-robust standard errors and
+    vce(cluster clustvar) standard errors that allow for correlation within
+    groups of clustvar; observations with clustvar missing are not used.
+    Both are computed from the scores of the observations in a second pass
+    over the data, clusters summed by one grouped pass over their codes.
+    robust and cluster(clustvar) are synonyms.
+
+    absorb(varlist) partials the indicators of every variable in varlist
+    out of the dependent variable and the regressors by alternating
+    projections over the group codes, then regresses the demeaned data; no
+    indicator columns are formed.  Degrees of freedom are reduced by the
+    rank of the absorbed indicators, exact for up to two variables.
+
+    aweights, fweights, and pweights are allowed; see weight.  aweights and
+    pweights are rescaled to sum to the number of observations; pweights
+    imply vce(robust).
+
 
 """
+    using = None
+    chunksize = 100000
+    vce = None
+    clustvar = None
+    absorb = []
+    weighting = None
+
     def check_input():
+        nonlocal args, using, chunksize, vce, absorb, weighting
+        if 'using' in args:
+            if args.index('using') != len(args) - 2:
+                raise SyntaxError('invalid file specification')
+            using = dta_path(args[-1])
+            args = args[:-2]
+            try:
+                check_by(by)
+            except SyntaxError as e:
+                raise SyntaxError('regress using' + e.msg)
         if len(args) == 0:
             raise SyntaxError('no variable provided')
         if len(args) == 1:
             raise SyntaxError('no independent variable provided')
-        for i, opt in enumerate(option):
-            if i >= 1 or opt != 'noconstant':
+        for opt in option:
+            result = re.fullmatch(r'chunksize\((\d+)\)', opt)
+            if result and using is not None and int(result.group(1)) > 0:
+                chunksize = int(result.group(1))
+            elif re.fullmatch(r'vce\(.*\)|robust|cluster\(.*\)', opt):
+                check_vce(opt)
+            elif re.fullmatch(r'a(bsorb|bsor|bso|bs|b)?\(.*\)', opt) and not absorb:
+                absorb = opt[opt.index('(') + 1:-1].split()
+                if not absorb:
+                    raise SyntaxError('option absorb() requires a varlist')
+            elif opt != 'noconstant' or option.count(opt) > 1:
                 raise SyntaxError('option %s not allowed' % opt)
-
-    def estimate(y: np.ndarray, X: np.ndarray):
-        n, k = X.shape
-        try:
-            inv = np.linalg.inv(X.T.dot(X))
-        except:
-            raise RuntimeError('collinearity exists, no estimation can be carried out')
-        ret = dict()
-        # estimation
-        ret['beta'] = inv.dot(X.T).dot(y)
-        e = X.dot(ret['beta']) - y
-        # upperleft table
-        M0 = np.eye(n) - np.ones((n, n)) / n
-        ret['SST'] = y.T.dot(M0).dot(y)
-        ret['SSR'] = ret['beta'].T.dot(X.T).dot(M0).dot(X).dot(ret['beta'])
-        ret['SSE'] = e.T.dot(e)
-        ret['df'] = (n - 1, k - 1, n - k)
-        ret['MS'] = (ret['SST'] / ret['df'][0], ret['SSR'] / ret['df'][1], ret['SSE'] / ret['df'][2])
-        # bottom table
-        sigma_sq = e.T.dot(e) / (n - k)
-        ret['std_err'] = sigma_sq * np.linalg.inv(X.T.dot(X))
-        ret['std_err'] = np.sqrt([ret['std_err'][i, i] for i in range(k)])
-        ret['t'] = ret['beta'] / ret['std_err']
-        ret['p'] = (1 - stats.t.cdf(np.abs(ret['t']), df=n - k)) * 2
-        ret['CI'] = stats.t.interval(0.95, n - k, ret['beta'], ret['std_err'])
-        # upperright table
-        ret['no_of_obs'] = n
-        ret['F_df'] = ret['df'][1:3]
-        ret['R_sq'] = ret['SSR'] / ret['SST']
-        ret['F'] = (ret['R_sq'] / ret['F_df'][0]) / ((1 - ret['R_sq']) / ret['F_df'][1])
-        ret['F_prob'] = 1 - stats.f.cdf(ret['F'], dfn=ret['F_df'][0], dfd=ret['F_df'][1])
-        ret['adj_R_sq'] = 1 - (n - 1) / (n - k) * (1 - ret['R_sq'])
-        ret['MSE'] = np.sqrt(ret['MS'][2])
-        return ret
-
-    def main():
-        nonlocal args
-        try:
-            check_input()
-        except SyntaxError as e:
-            print_red(e.msg)
-            return
-        data = split_data(self.data, _in, _if, by)
-        data = data[args].values[np.all(~np.isnan(data[args].values), axis=1)]
-        y, X = data[:, 0], data[:, 1:]
-        if 'noconstant' not in option:
-            X = np.concatenate((X, np.ones((X.shape[0], 1))), axis=1)
-            args = args + ['_cons']
+        weighting = parse_weight(weight, ('aweight', 'fweight', 'pweight'))
+        if weighting is not None and weighting[0] == 'pweight':
+            if vce == 'ols':
+                raise SyntaxError('vce(ols) not allowed with pweights')
+            vce = vce or 'robust'
+        if vce == 'ols':
+            vce = None
+        if absorb and using is not None:
+            raise SyntaxError('absorb() not allowed with using')
+        if absorb and 'noconstant' in option:
+            raise SyntaxError('noconstant not allowed with absorb()')
+
+    def check_vce(opt: str):
+        nonlocal vce, clustvar
+        if vce is not None:
+            raise SyntaxError('only one vce() option allowed')
+        if opt == 'robust':
+            words = ['robust']
+        elif opt.startswith('cluster('):
+            words = ['cluster'] + opt[8:-1].split()
+        else:
+            words = opt[4:-1].split()
+        if not words:
+            raise SyntaxError('option vce() invalid')
+        if words == ['ols']:
+            vce = 'ols'
+        elif len(words) == 1 and 'robust'.startswith(words[0]):
+            vce = 'robust'
+        elif len(words[0]) >= 2 and 'cluster'.startswith(words[0]):
+            if len(words) != 2:
+                raise SyntaxError('option vce(cluster) requires exactly one cluster variable')
+            vce, clustvar = 'cluster', words[1]
+        else:
+            raise SyntaxError('vcetype %s not allowed' % words[0])
+
+    def clusters(data: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+        """Observations with clustvar not missing, and the values of clustvar"""
+        values = column(data[clustvar])
+        keep = ~missing(values)
+        return data[keep], values[keep]
+
+    def variables(data: pd.DataFrame) -> List[str]:
+        """Variables used besides depvar and indepvars"""
+        return ([clustvar] if clustvar is not None else []) + absorb + weight_variables(weighting, data)
+
+    def weights_of(data: pd.DataFrame) -> Optional[np.ndarray]:
+        return None if weighting is None else weight_values(weighting, data)
+
+    def cross_products(cp: CrossProducts) -> Tuple[float, float]:
+        """Sum of the weights; aweights and pweights are then rescaled"""
+        sum_w = cp.n
+        if weighting is None or weighting[0] == 'fweight':
+            return 1.0, sum_w
+        return cp.normalize(), sum_w
+
+    def scores_of(coef: dict, constant: bool, clustered: bool) -> Scores:
+        return Scores(coef['beta'], constant=constant, clustered=clustered,
+                      frequency=weighting is not None and weighting[0] == 'fweight')
+
+    def robust(coef: dict, scores: Scores) -> dict:
+        V = scores.covariance(coef['XX_inv'], absorbed=coef.get('absorbed', 1) - 1)
+        df_r = scores.clusters - 1 if vce == 'cluster' else coef['df'][2]
+        coef = robust_inference(coef, V, df_r, constant='noconstant' not in option)
+        coef['N_clust'] = scores.clusters
+        return coef
+
+    def estimate(data: pd.DataFrame) -> dict:
+        codes = None
+        if vce == 'cluster':
+            data, values = clusters(data)
+            codes = pd.factorize(values)[0]
+        weights = weights_of(data)
+        if absorb:
+            return estimate_absorbed(data, codes, weights)
+        columns = column_views(data, args)
+        cp = CrossProducts(len(args))
+        cp.update_columns(columns, weights)
+        scale, sum_w = cross_products(cp)
+        coef = ols(cp, constant='noconstant' not in option)
+        coef['sum_w'] = sum_w
+        if vce is None:
+            return coef
+        scores = scores_of(coef, 'noconstant' not in option, codes is not None)
+        scores.update_columns(columns, codes, None if weights is None else weights * scale)
+        return robust(coef, scores)
+
+    def estimate_absorbed(data: pd.DataFrame, codes: Optional[np.ndarray], weights: Optional[np.ndarray]) -> dict:
+        columns = column_views(data, args)
+        Z = np.column_stack(columns).astype(float)
+        keep = observed(columns)
+        if weights is not None:
+            keep &= weights > 0
+        levels = []
+        for var in absorb:
+            values = column(data[var])
+            keep &= ~missing(values)
+            levels.append(values)
+        Z = Z[keep]
+        groups = [pd.factorize(values[keep])[0] for values in levels]
+        if Z.shape[0] == 0:
+            raise RuntimeError('no observations')
+        rank = absorbed_rank(groups)
+        if weights is not None:
+            weights = weights[keep]
+        # with the grand means added back, the demeaned data give the slopes
+        # and the constant of the regression with all the indicators
+        W = demean(Z, groups, weights) + np.average(Z, axis=0, weights=weights)
+        cp = CrossProducts(len(args))
+        cp.update(W, weights)
+        scale, sum_w = cross_products(cp)
+        coef = ols(cp, absorbed=rank - 1)
+        coef['sum_w'] = sum_w
+        pooled = CrossProducts(len(args))
+        pooled.update(Z, weights)
+        cross_products(pooled)
         try:
-            coef = estimate(y, X)
-        except RuntimeError as e:
-            print_red(e.args)
+            SSE_pooled = ols(pooled)['SSE']
+        except RuntimeError:
+            SSE_pooled = np.nan
+        coef = absorbed_fit(coef, pooled.comoment[0, 0], SSE_pooled, rank)
+        if vce is None:
+            return coef
+        scores = scores_of(coef, True, codes is not None)
+        scores.update(W, None if codes is None else codes[keep], None if weights is None else weights * scale)
+        return robust(coef, scores)
+
+    def estimate_using(dir: str) -> dict:
+        empty, meta = read_metadata(dir)
+        for var in args:
+            if var not in meta.column_names:
+                raise SyntaxError('variable %s not found' % var)
+        offset, limit = (_in[0], _in[1] - _in[0]) if _in is not None else (0, 0)
+        if _in is not None and limit <= 0:
+            raise SyntaxError('no observations')
+        if clustvar is not None and clustvar not in meta.column_names:
+            raise SyntaxError('variable %s not found' % clustvar)
+        usecols = list(args) + ([clustvar] if clustvar is not None else []) + weight_variables(weighting, empty)
+        if _if is not None:
+            usecols += compile_expression(_if, empty).variables
+        usecols = list(dict.fromkeys(usecols))
+
+        def chunks():
+            for chunk in read_chunks(dir, usecols, chunksize, offset, limit):
+                if _if is not None:
+                    chunk = chunk[evaluate_if(_if, chunk)]
+                yield clusters(chunk) if clustvar is not None else (chunk, None)
+
+        cp = CrossProducts(len(args))
+        for chunk, _ in chunks():
+            cp.update_columns(column_views(chunk, args), weights_of(chunk))
+        scale, sum_w = cross_products(cp)
+        coef = ols(cp, constant='noconstant' not in option)
+        coef['sum_w'] = sum_w
+        if vce is None:
+            return coef
+        # the file is read again for the residuals; cluster values are coded
+        # in order of appearance across chunks
+        scores = scores_of(coef, 'noconstant' not in option, clustvar is not None)
+        seen = pd.Index([])
+        for chunk, values in chunks():
+            codes = None
+            if values is not None:
+                codes, uniques = pd.factorize(values)
+                known = seen.get_indexer(uniques)
+                new = known < 0
+                known[new] = len(seen) + np.arange(new.sum())
+                seen = seen.append(pd.Index(uniques[new]))
+                codes = known[codes]
+            weights = weights_of(chunk)
+            scores.update_columns(column_views(chunk, args), codes, None if weights is None else weights * scale)
+        return robust(coef, scores)
+
+    def store_results(coef: dict, names: List[str]):
+        self.e = {'cmd': 'regress', 'depvar': names[0], 'N': int(coef['no_of_obs']),
+                  'df_m': coef['df'][1], 'df_r': coef['df'][2], 'F': coef['F'],
+                  'r2': coef['R_sq'], 'r2_a': coef['adj_R_sq'], 'rmse': coef['MSE'],
+                  'mss': coef['SSR'], 'rss': coef['SSE'],
+                  'b': pd.DataFrame([coef['beta']], index=['y1'], columns=names[1:]),
+                  'V': pd.DataFrame(coef['V'], index=names[1:], columns=names[1:])}
+        if weighting is not None:
+            self.e.update({'wtype': weighting[0], 'wexp': '= ' + weighting[1]})
+        if vce is not None:
+            self.e.update({'vce': vce, 'vcetype': 'Robust', 'df_r': coef['df_r']})
+        if vce == 'cluster':
+            self.e.update({'clustvar': clustvar, 'N_clust': coef['N_clust']})
+        if absorb:
+            self.e.update({'absvar': ' '.join(absorb), 'df_a': coef['absorbed'] - 1,
+                           'F_absorb': coef['F_absorb'], 'r2_within': coef['R_sq_within']})
+
+    def display_header(coef: dict):
+        if vce is None and not absorb:
+            display_anova(coef)
             return
+        header = [('Linear regression', 'Number of obs', format(int(coef['no_of_obs']), ','))]
+        if absorb:
+            header = [('Linear regression, absorbing indicators',) + header[0][1:],
+                      ('Absorbed variable%s: %s' % ('s' if len(absorb) > 1 else '', ' '.join(absorb)),
+                       'No. of categories' if len(absorb) == 1 else 'Absorbed levels',
+                       format(int(coef['absorbed']), ','))]
+        # an F test that cannot be computed is shown as missing
+        header += [('', 'F(%d, %d)' % coef['F_df'], '.' if np.isnan(coef['F']) else '%.2f' % coef['F']),
+                   ('', 'Prob > F', '.' if np.isnan(coef['F_prob']) else '%.4f' % coef['F_prob']),
+                   ('', 'R-squared', '%.4f' % coef['R_sq'])]
+        if absorb:
+            header.append(('', 'Adj R-squared', '%.4f' % coef['adj_R_sq']))
+        header.append(('', 'Root MSE', parse_number(coef['MSE'], length=6).strip()))
+        # under by, the group header already ends in a blank line
+        if by is None:
+            print()
+        for title, label, value in header:
+            print('%s%-18s= %10s' % (title.ljust(48), label, value))
+        print()
+        if vce == 'cluster':
+            print(('(Std. Err. adjusted for %s clusters in %s)'
+                   % (format(coef['N_clust'], ','), clustvar)).rjust(78))
+
+    def display_anova(coef: dict):
         print('      Source |       SS           df       MS      Number of obs   = %s'
               % parse_number(coef['no_of_obs'], length=9))
         print('-------------+----------------------------------   F%s = %9.2f'
@@ -471,7 +1014,15 @@ Syntax
               % (parse_number(coef['SST'], length=10), parse_number(coef['df'][0], length=9),
                  parse_number(coef['MS'][0], length=10), parse_number(coef['MSE'], length=6)))
         print()
+
+    @timed('output')
+    def display(coef: dict, args: List[str]):
+        if weighting is not None and weighting[0] != 'fweight':
+            print('(sum of wgt is %.4e)' % coef['sum_w'])
+        display_header(coef)
         print('------------------------------------------------------------------------------')
+        if vce is not None:
+            print('             |               Robust')
         print('%s |      Coef.   Std. Err.      t    P>|t|     [95%% Conf. Interval]'
               % parse_varname(args[0], length=12))
         print('-------------+----------------------------------------------------------------')
@@ -481,41 +1032,155 @@ Syntax
                      parse_number(coef['std_err'][i]), coef['t'][i], coef['p'][i],
                      parse_number(coef['CI'][0][i]), parse_number(coef['CI'][1][i])))
         print('------------------------------------------------------------------------------')
+        if absorb and vce is None:
+            print('%sProb > F = %.4f' % (('F test of absorbed indicators: F(%d, %d) = %.3f'
+                                         % (coef['F_absorb_df'] + (coef['F_absorb'],))).ljust(62),
+                                        coef['F_absorb_prob']))
+
+    def main():
+        try:
+            check_input()
+            if using is not None:
+                data = None
+            else:
+                data = split_data(self.data, _in, _if, by)
+                frame = data.data if isinstance(data, Groups) else data
+                get_varlist(args + variables(frame), frame)
+                if not all(is_numeric(frame[var]) for var in args):
+                    raise SyntaxError('type mismatch')
+                if weighting is not None:
+                    weight_values(weighting, frame)
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        names = args + ['_cons'] if 'noconstant' not in option else args
+        if isinstance(data, Groups):
+            for g, group in data.slices(list(dict.fromkeys(args + variables(data.data)))):
+                if not self.quietly:
+                    print_by_header(data.label(g, self.meta.variable_value_labels))
+                try:
+                    coef = estimate(group)
+                except RuntimeError as e:
+                    print_red(e.args)
+                    continue
+                store_results(coef, names)
+                if not self.quietly:
+                    display(coef, names)
+            return
+        try:
+            if data is None:
+                coef = estimate_using(using)
+            else:
+                coef = estimate(data)
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        except RuntimeError as e:
+            print_red(e.args)
+            return
+        store_results(coef, names)
+        if not self.quietly:
+            display(coef, names)
 
     main()
 
 
-def pwcorr(self: StataPlatform, args: List[str],
-           by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
-           weight: Optional[str], option: List[str]):
+def areg(self: StataPlatform, args: List[str],
+         by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+         weight: Optional[str], option: List[str]):
     """
 Title
 
-    [R] correlate -- Correlations (covariances) of variables or coefficients
+    [R] areg -- Linear regression with a large dummy-variable set
 
 
 Syntax
 
-    Display all pairwise correlation coefficients
+        areg depvar [indepvars] [if] [in] , absorb(varname) [options]
+
 
-        pwcorr [varlist] [if] [in] [weight]
+    areg is regress with the absorb() option required; see help regress for
+    the other options.
 
 
 """
     def check_input():
-        check_option(option)
+        if not any(re.fullmatch(r'a(bsorb|bsor|bso|bs|b)?\(.*\)', opt) for opt in option):
+            raise SyntaxError('option absorb() required')
 
     def main():
         try:
             check_input()
-            data = split_data(self.data, _in, _if, by)
-            varlist = get_varlist(args, data)
         except SyntaxError as e:
             print_red(e.msg)
             return
-        for var in varlist:
-            if isinstance(data[var][0], str):
-                varlist = varlist.drop(var)
+        regress(self, args, by=by, _if=_if, _in=_in, weight=weight, option=option)
+
+    main()
+
+
+def pwcorr(self: StataPlatform, args: List[str],
+           by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+           weight: Optional[str], option: List[str]):
+    """
+Title
+
+    [R] correlate -- Correlations (covariances) of variables or coefficients
+
+
+Syntax
+
+    Display all pairwise correlation coefficients
+
+        pwcorr [varlist] [if] [in] [weight] [, pwcorr_options]
+
+    pwcorr_options    Description
+    -------------------------------------------------------------------------
+    obs               print number of observations for each entry
+    sig               print significance level for each entry
+    star(#)           significance level for displaying with a star
+    -------------------------------------------------------------------------
+
+    aweights and fweights are allowed; see weight.  Numbers of observations
+    are sums of fweights.
+
+
+"""
+    star = None
+    weighting = None
+
+    def check_input():
+        nonlocal star, weighting
+        weighting = parse_weight(weight, ('aweight', 'fweight'))
+        for opt in option:
+            result = re.fullmatch(r'star\((.+)\)', opt)
+            if result:
+                try:
+                    star = float(result.group(1))
+                except ValueError:
+                    raise SyntaxError('option %s not allowed' % opt)
+            elif opt not in ('obs', 'sig'):
+                raise SyntaxError('option %s not allowed' % opt)
+
+    def correlate(data, varlist) -> tuple:
+        if varlist:
+            X = np.column_stack([numeric_values(data[var]) for var in varlist])
+        else:
+            X = np.empty((data.shape[0], 0))
+        if weighting is None:
+            r, N, p = pairwise_correlation(X)
+        else:
+            r, N, p = pairwise_correlation(X, weight_values(weighting, data), weighting[0] == 'fweight')
+        # r(rho) and r(N) are those of the last pair of variables
+        self.r = {'C': pd.DataFrame(r, index=varlist, columns=varlist)}
+        if len(varlist) >= 2:
+            self.r.update({'N': int(N[-1, -2]), 'rho': r[-1, -2]})
+        return r, N, p
+
+    @timed('output')
+    def display(r, N, p, varlist):
+        # leave room for the star after each coefficient
+        width, pad = (9, '') if star is None else (8, ' ')
         batch = 0
         while len(varlist) - batch * 7 > 0:
             count = min(7, len(varlist) - batch * 7)
@@ -524,14 +1189,44 @@ Syntax
                             for var in varlist[batch * 7:batch * 7 + count]]))
             print('-------------+' + '-' * 9 * count)
             for i in range(batch * 7, len(varlist)):
+                columns = range(batch * 7, min(i + 1, batch * 7 + count))
                 print('%s |' % parse_varname(varlist[i], 12, pos='r'), end='')
-                for j in range(7):
-                    if j + batch * 7 > i:
-                        break
-                    print('%9.4f' % data[varlist[i]].corr(data[varlist[j + batch * 7]]), end='')
+                for j in columns:
+                    mark = '' if star is None else '*' if i != j and p[i, j] <= star else ' '
+                    print(parse_stat(r[i, j], length=width) + mark, end='')
                 print()
+                if 'sig' in option:
+                    print('             |' + ''.join(' ' * 9 if i == j else parse_stat(p[i, j], length=width) + pad
+                                                     for j in columns))
+                if 'obs' in option:
+                    print('             |' + ''.join(str(N[i, j]).rjust(width, ' ') + pad for j in columns))
+                if 'sig' in option or 'obs' in option:
+                    print('             |')
             batch += 1
             print()
 
-    main()
+    def main():
+        try:
+            check_input()
+            data = split_data(self.data, _in, _if, by)
+            frame = data.data if isinstance(data, Groups) else data
+            varlist = get_varlist(args, frame)
+            columns = weight_variables(weighting, frame)
+            if weighting is not None:
+                weight_values(weighting, frame)
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        varlist = [var for var in varlist if numeric_values(frame[var]) is not None]
+        if isinstance(data, Groups):
+            for g, group in data.slices(list(dict.fromkeys(varlist + columns))):
+                results = correlate(group, varlist)
+                if not self.quietly:
+                    print_by_header(data.label(g, self.meta.variable_value_labels))
+                    display(*results, varlist)
+        else:
+            results = correlate(data, varlist)
+            if not self.quietly:
+                display(*results, varlist)
 
+    main()
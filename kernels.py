@@ -0,0 +1,247 @@
+from typing import List, Optional, Tuple
+from pandas import DataFrame
+import numpy as np
+
+
+PERCENTILES = (1, 5, 10, 25, 50, 75, 90, 95, 99)
+# values converted and reduced at a time by the column kernels
+BLOCK_ELEMENTS = 1 << 20
+
+
+def pairwise_correlation(X: np.ndarray, weights: Optional[np.ndarray] = None,
+                         frequency: bool = True) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pairwise-complete correlations, observation counts and significance
+    levels of the columns of X
+
+    Every pair's sums are read from four matrix products of the centered,
+    zero-filled data and its missing mask, so all p x p cells are computed
+    together instead of one pandas call per cell.  With weights, the mask
+    holds the weight of each observation; the counts are sums of frequency
+    weights, or numbers of observations for analytic weights.
+    """
+    from scipy import special
+    valid = ~np.isnan(X)
+    if weights is not None:
+        valid &= (weights > 0)[:, None]
+    M = valid.astype(float)
+    X = np.where(valid, X, 0)
+    if weights is None:
+        X -= valid * (X.sum(axis=0) / np.maximum(valid.sum(axis=0), 1))
+        N = M.T.dot(M)
+        S = X.T.dot(M)
+        Q = (X * X).T.dot(M)
+        C = X.T.dot(X)
+        counts = N
+    else:
+        MW = M * np.where(np.isnan(weights), 0, weights)[:, None]
+        X -= valid * ((X * MW).sum(axis=0) / np.maximum(MW.sum(axis=0), np.finfo(float).tiny))
+        XW = X * MW
+        N = MW.T.dot(M)
+        S = XW.T.dot(M)
+        Q = (XW * X).T.dot(M)
+        C = XW.T.dot(X)
+        counts = N if frequency else M.T.dot(M)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = Q - S ** 2 / N
+        r = (C - S * S.T / N) / np.sqrt(var * var.T)
+        r = np.clip(r, -1, 1)
+        np.fill_diagonal(r, np.where(np.diag(counts) > 1, 1.0, np.nan))
+        t = r * np.sqrt((counts - 2) / (1 - r ** 2))
+        p = 2 * special.stdtr(counts - 2, -np.abs(t))
+    p[counts <= 2] = np.nan
+    return r, np.rint(counts).astype(int), p
+
+
+def order_statistics(X: np.ndarray, percentiles: Tuple[int, ...] = PERCENTILES,
+                     extremes: int = 4, weights: Optional[np.ndarray] = None,
+                     frequency: bool = True) -> List[Optional[dict]]:
+    """
+    Stata's summarize percentiles and the smallest and largest values of
+    every column of X, missing values excluded
+
+    Columns with the same number of nonmissing values are partitioned
+    together in one multi-k np.partition call, which places exactly the
+    order statistics needed without sorting the whole column.  Weighted
+    percentiles take one sorted pass per column instead.
+    """
+    if weights is not None:
+        return [weighted_order_statistics(X[:, j], weights, frequency, percentiles, extremes)
+                for j in range(X.shape[1])]
+    results = [None] * X.shape[1]
+    valid = ~np.isnan(X)
+    counts = valid.sum(axis=0)
+    for n in np.unique(counts):
+        if n == 0:
+            continue
+        columns = np.flatnonzero(counts == n)
+        if n == X.shape[0]:
+            block = X[:, columns]
+        else:
+            block = np.column_stack([X[valid[:, j], j] for j in columns])
+        # x[P] is read at P = n * p / 100 rounded up, or halfway between
+        # x[P] and x[P + 1] when P is a whole number
+        lower = np.array([n * p // 100 - (n * p % 100 == 0) for p in percentiles])
+        upper = np.array([n * p // 100 for p in percentiles])
+        m = min(extremes, n)
+        kth = np.unique(np.concatenate((lower, upper, np.arange(m), np.arange(n - m, n))))
+        block = np.partition(block, kth, axis=0)
+        values = (block[lower] + block[upper]) / 2
+        for i, j in enumerate(columns):
+            # copies, so the results do not keep the partitioned block alive
+            results[j] = {'percentiles': dict(zip(percentiles, values[:, i])),
+                          'smallest': block[:m, i].copy(), 'largest': block[n - m:, i].copy()}
+    return results
+
+
+def weighted_order_statistics(x: np.ndarray, weights: np.ndarray, frequency: bool = True,
+                              percentiles: Tuple[int, ...] = PERCENTILES, extremes: int = 4) -> Optional[dict]:
+    """
+    order_statistics of one column with weights, from one sorted pass
+
+    The pth percentile is the first value whose cumulative weight exceeds
+    P = W p / 100, or halfway between it and the one before when that one's
+    cumulative weight is exactly P, which with frequency weights is the
+    percentile of the expanded data.  The smallest and largest values also
+    repeat as often as their frequency weight says.
+    """
+    keep = ~np.isnan(x) & (weights > 0)
+    if not keep.any():
+        return None
+    order = np.argsort(x[keep], kind='stable')
+    x, w = x[keep][order], weights[keep][order]
+    cum = np.cumsum(w)
+    P = cum[-1] * np.array(percentiles) / 100
+    upper = np.minimum(np.searchsorted(cum, P, side='right'), len(x) - 1)
+    lower = np.maximum(upper - 1, 0)
+    values = np.where((upper > 0) & (cum[lower] == P), (x[lower] + x[upper]) / 2, x[upper])
+    repeats = np.cumsum(w) if frequency else np.arange(1, len(x) + 1)
+    total = int(round(repeats[-1]))
+    m = min(extremes, total)
+    return {'percentiles': dict(zip(percentiles, values)),
+            'smallest': x[np.searchsorted(repeats, np.arange(1, m + 1))],
+            'largest': x[np.searchsorted(repeats, np.arange(total - m + 1, total + 1))]}
+
+
+def column_moments(X: np.ndarray, weights: Optional[np.ndarray] = None, frequency: bool = True) -> dict:
+    """
+    Count, mean, variance, skewness and kurtosis of every column of X,
+    missing values excluded
+
+    With weights, the moments are weighted and sum_w is the sum of the
+    weights; the count is that sum for frequency weights and the number of
+    observations for analytic weights, which variance is corrected by.
+
+    X is read one block of rows at a time, twice: once for the means and
+    once for the central moments around them, so the temporaries are the
+    size of a block however long the columns are.
+    """
+    k = X.shape[1]
+    rows = max(1, BLOCK_ELEMENTS // max(k, 1))
+
+    def blocks():
+        for start in range(0, X.shape[0], rows):
+            block = X[start:start + rows]
+            valid = ~np.isnan(block)
+            if weights is None:
+                yield block, valid, None
+                continue
+            w = weights[start:start + rows]
+            valid &= (w > 0)[:, None]
+            yield block, valid, np.where(valid, w[:, None], 0)
+
+    n = np.zeros(k, dtype=int)
+    sum_w = np.zeros(k)
+    total = np.zeros(k)
+    for block, valid, w in blocks():
+        n += valid.sum(axis=0)
+        filled = np.where(valid, block, 0)
+        if w is None:
+            total += filled.sum(axis=0)
+        else:
+            sum_w += w.sum(axis=0)
+            total += (w * filled).sum(axis=0)
+    if weights is None:
+        sum_w = n
+    m2, m3, m4 = np.zeros(k), np.zeros(k), np.zeros(k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / sum_w
+        for block, valid, w in blocks():
+            dev = np.where(valid, block - mean, 0)
+            square = dev * dev
+            if w is not None:
+                dev = w * dev
+                square_w = w * square
+            else:
+                square_w = square
+            m2 += square_w.sum(axis=0)
+            m3 += (square * dev).sum(axis=0)
+            m4 += (square_w * square).sum(axis=0)
+        m3 /= sum_w
+        m4 /= sum_w
+        if frequency:
+            n = sum_w
+            variance = m2 / (n - 1)
+        else:
+            variance = m2 / sum_w * n / (n - 1)
+        skewness = m3 / (m2 / sum_w) ** 1.5
+        kurtosis = m4 / (m2 / sum_w) ** 2
+    return {'n': n, 'sum_w': sum_w, 'mean': mean, 'variance': variance, 'skewness': skewness,
+            'kurtosis': kurtosis}
+
+
+def column_summaries(data: DataFrame, weights: Optional[np.ndarray] = None, frequency: bool = True) -> dict:
+    """
+    Count, mean, variance, min and max of every column of a numeric frame,
+    missing values excluded
+
+    The frame is converted to float one block of rows at a time and each
+    block is reduced for all columns together; block results are merged
+    with the pairwise update of Chan, Golub and LeVeque, which keeps the
+    variance accurate without a second pass.  With weights, block sums are
+    weighted and merged by their sums of weights; counts are as in
+    column_moments.
+    """
+    k = data.shape[1]
+    rows_used = np.zeros(k)
+    n = np.zeros(k)
+    mean = np.zeros(k)
+    m2 = np.zeros(k)
+    _min = np.full(k, np.nan)
+    _max = np.full(k, np.nan)
+    rows = max(1, BLOCK_ELEMENTS // max(k, 1))
+    for start in range(0, data.shape[0], rows):
+        block = data.iloc[start:start + rows].to_numpy(dtype=float, na_value=np.nan)
+        valid = ~np.isnan(block)
+        if weights is None:
+            count = valid.sum(axis=0)
+            filled = np.where(valid, block, 0)
+        else:
+            w = weights[start:start + rows]
+            valid &= (w > 0)[:, None]
+            block = np.where(valid, block, np.nan)
+            w = np.where(valid, w[:, None], 0)
+            rows_used += valid.sum(axis=0)
+            count = w.sum(axis=0)
+            filled = np.where(valid, block, 0) * w
+        with np.errstate(divide='ignore', invalid='ignore'):
+            block_mean = np.where(count > 0, filled.sum(axis=0) / count, 0)
+        block_m2 = np.where(valid, block - block_mean, 0) ** 2
+        block_m2 = (block_m2 if weights is None else w * block_m2).sum(axis=0)
+        total = n + count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = block_mean - mean
+            m2 += block_m2 + np.where(total > 0, delta ** 2 * n * count / total, 0)
+            mean += np.where(total > 0, delta * count / total, 0)
+        n = total
+        if block.shape[0]:
+            _min = np.fmin(_min, np.fmin.reduce(block, axis=0))
+            _max = np.fmax(_max, np.fmax.reduce(block, axis=0))
+    sum_w = n
+    if weights is not None and not frequency:
+        n = rows_used
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = m2 / (n - 1) if weights is None or frequency else m2 / sum_w * n / (n - 1)
+        mean = np.where(n > 0, mean, np.nan)
+    return {'n': np.rint(n).astype(int), 'sum_w': sum_w, 'mean': mean, 'variance': variance,
+            'min': _min, 'max': _max}
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+import weakref
+
+
+# packed missing masks kept for reuse, one per column buffer
+CACHE_SIZE = 1024
+# cache: keep masks between commands; with it off, every mask is computed
+#        from the values when it is needed
+settings = {
+    'cache': True,
+}
+_cache = OrderedDict()
+
+
+def buffer_key(values: np.ndarray) -> tuple:
+    """The array owning the memory of values, and where in it values lie"""
+    owner = values
+    while isinstance(owner.base, np.ndarray):
+        owner = owner.base
+    return owner, (id(owner), values.__array_interface__['data'][0], values.shape, values.strides,
+                   values.dtype.str)
+
+
+def missing_bits(values: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Missing values of a numeric column as a packed bit array, None when the
+    column cannot hold any
+
+    Every missing value, . and the extended .a to .z alike, is NaN once
+    read, so one NaN scan finds them all.  Masks are cached by the memory
+    of the column, so the scan is done once per column however many
+    commands use it; a column replaced or dropped gets a new buffer, and
+    its entry goes when the old one is freed.  Values changed in place keep
+    their buffer, so whatever changes them must call cache_clear(), as
+    StataPlatform.data_changed() does.
+    """
+    if values.dtype.kind in 'biu':
+        return None
+    if not settings['cache']:
+        return np.packbits(np.isnan(values))
+    owner, key = buffer_key(values)
+    entry = _cache.get(key)
+    if entry is not None and entry[0]() is owner:
+        _cache.move_to_end(key)
+        return entry[1]
+    bits = np.packbits(np.isnan(values))
+    try:
+        ref = weakref.ref(owner, lambda _, key=key: _cache.pop(key, None))
+    except TypeError:
+        return bits
+    _cache[key] = (ref, bits)
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return bits
+
+
+def observed(columns: List[np.ndarray]) -> np.ndarray:
+    """Rows with no missing value in any of the columns, by OR of their packed masks"""
+    n = len(columns[0]) if columns else 0
+    packed = None
+    for values in columns:
+        bits = missing_bits(values)
+        if bits is None:
+            continue
+        packed = bits.copy() if packed is None else np.bitwise_or(packed, bits, out=packed)
+    if packed is None:
+        return np.ones(n, dtype=bool)
+    return np.unpackbits(packed, count=n) == 0
+
+
+def cache_clear():
+    _cache.clear()
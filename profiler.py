@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Optional
+import json
+import time
+import tracemalloc
+
+
+# phases a command's wall time is split into; compute is whatever is not
+# spent in one of the others
+PHASES = ('parse', 'prep', 'compute', 'output')
+
+# records of the commands running, innermost last
+_stack = []
+
+
+class Profiler:
+    """
+    Per-command wall time by phase and peak memory growth
+
+    Memory is traced with tracemalloc, which NumPy reports its buffers to,
+    only while the profiler is active; records are kept in ``records`` and,
+    with a log file, appended to it as one JSON object per line.
+    """
+    def __init__(self, log: Optional[str] = None):
+        self.records = []
+        self.log = log
+        tracemalloc.start()
+
+    def close(self):
+        tracemalloc.stop()
+
+    def begin(self, command: str, parse: float = 0.0):
+        # the peak is reset for every command; an enclosing one (a do-file)
+        # keeps the highest peak seen so far
+        if _stack:
+            _stack[-1]['peak'] = max(_stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        _stack.append({'command': command, 'depth': len(_stack), 'time': time.time(),
+                       'parse': parse, 'prep': 0.0, 'compute': 0.0, 'output': 0.0,
+                       'start': time.perf_counter(), 'memory': tracemalloc.get_traced_memory()[0], 'peak': 0})
+
+    def end(self) -> dict:
+        record = _stack.pop()
+        run = time.perf_counter() - record.pop('start')
+        record['compute'] = max(run - record['prep'] - record['output'], 0.0)
+        record['total'] = record['parse'] + run
+        peak = max(record.pop('peak'), tracemalloc.get_traced_memory()[1])
+        record['peak_memory'] = max(peak - record.pop('memory'), 0)
+        if _stack:
+            _stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+        self.records.append(record)
+        if self.log is not None:
+            with open(self.log, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        return record
+
+
+@contextmanager
+def phase(name: str):
+    """Charge the time spent in the block to a phase of the running command"""
+    if not _stack:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stack[-1][name] += time.perf_counter() - start
+
+
+def timed(name: str) -> Callable:
+    """Decorator charging every call of a function to a phase"""
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _stack:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,505 @@
+from typing import List, Optional, Tuple
+import numpy as np
+from masks import observed
+
+# scipy is imported by the functions that use it, and only its special
+# functions and linalg: scipy.stats takes longer to load than everything
+# else a command needs
+
+# rows folded into the cross products at a time, keeps the centered
+# temporary at BLOCK_ROWS x k no matter how long the data is
+BLOCK_ROWS = 65536
+# fixed effects are partialled out until no group mean of any dimension
+# moves a column by more than this, relative to its standard deviation
+DEMEAN_TOL = 1e-8
+DEMEAN_MAX_ITER = 10000
+# a regressor whose squared partial correlation with the previous ones
+# leaves less than this much of its variance is treated as collinear
+COLLINEARITY_TOL = 1e-12
+
+
+class CrossProducts:
+    """
+    Running column means and centered cross products of a row stream
+
+    Column 0 is the dependent variable, the remaining columns are the
+    regressors (without the constant).  Blocks are merged with the pairwise
+    update of Chan, Golub and LeVeque, so one pass over the data is enough
+    and the result does not depend on how the rows were chunked.  With
+    weights, n is the sum of the weights and rows the number of rows with a
+    positive weight.
+    """
+    def __init__(self, k: int):
+        self.n = 0
+        self.rows = 0
+        self.mean = np.zeros(k)
+        self.comoment = np.zeros((k, k))
+
+    def update(self, block: np.ndarray, weights: Optional[np.ndarray] = None):
+        """Fold in rows, each counted weights times if given"""
+        block = np.asarray(block, dtype=float)
+        for start in range(0, block.shape[0], BLOCK_ROWS):
+            chunk = block[start:start + BLOCK_ROWS]
+            if weights is None:
+                mean = chunk.mean(axis=0)
+                centered = chunk - mean
+                self.rows += chunk.shape[0]
+                self.merge(chunk.shape[0], mean, centered.T.dot(centered))
+                continue
+            w = weights[start:start + BLOCK_ROWS]
+            self.rows += int(np.count_nonzero(w > 0))
+            n = w.sum()
+            if n <= 0:
+                continue
+            mean = w.dot(chunk) / n
+            centered = chunk - mean
+            self.merge(n, mean, (centered * w[:, None]).T.dot(centered))
+
+    def update_columns(self, columns: List[np.ndarray], weights: Optional[np.ndarray] = None):
+        """
+        Fold in the rows of separate column arrays, skipping rows with a
+        missing value or weight; only BLOCK_ROWS rows are ever stacked at a
+        time, so memory-mapped columns are streamed rather than copied whole.
+        Missing rows are found from the cached masks of the columns.
+        """
+        if weights is not None:
+            columns = list(columns) + [weights]
+        n = len(columns[0]) if columns else 0
+        valid = observed(columns)
+        complete = valid.all()
+        for start in range(0, n, BLOCK_ROWS):
+            block = np.column_stack([column[start:start + BLOCK_ROWS] for column in columns]).astype(float)
+            if not complete:
+                block = block[valid[start:start + BLOCK_ROWS]]
+            if weights is None:
+                self.update(block)
+            else:
+                self.update(block[:, :-1], block[:, -1])
+
+    def normalize(self) -> float:
+        """
+        Rescale analytic weights to sum to the number of rows, as Stata
+        does; returns the factor the weights were multiplied by
+        """
+        scale = self.rows / self.n if self.n > 0 else 1.0
+        self.comoment *= scale
+        self.n = self.rows
+        return scale
+
+    def merge(self, n: int, mean: np.ndarray, comoment: np.ndarray):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.comoment += comoment + np.outer(delta, delta) * (self.n * n / total)
+        self.mean += delta * (n / total)
+        self.n = total
+
+
+class Factor:
+    """Cholesky factor of a scaled positive definite matrix"""
+    def __init__(self, A: np.ndarray):
+        from scipy import linalg
+        diag = np.diag(A)
+        if np.any(diag <= 0):
+            raise RuntimeError('collinearity exists, no estimation can be carried out')
+        self.scale = 1 / np.sqrt(diag)
+        try:
+            self.cho = linalg.cho_factor(A * np.outer(self.scale, self.scale), lower=False)
+        except linalg.LinAlgError:
+            raise RuntimeError('collinearity exists, no estimation can be carried out')
+        if np.min(np.diag(self.cho[0])) ** 2 < COLLINEARITY_TOL:
+            raise RuntimeError('collinearity exists, no estimation can be carried out')
+
+    def solve(self, b: np.ndarray) -> np.ndarray:
+        from scipy import linalg
+        scale = self.scale if b.ndim == 1 else self.scale[:, None]
+        return scale * linalg.cho_solve(self.cho, scale * b)
+
+    def inv(self) -> np.ndarray:
+        return self.solve(np.eye(len(self.scale)))
+
+
+def coefficients(cp: CrossProducts, constant: bool = True) -> np.ndarray:
+    """The coefficients of ols alone, for replications that need no more"""
+    my, mx = cp.mean[0], cp.mean[1:]
+    Sxy, Sxx = cp.comoment[1:, 0], cp.comoment[1:, 1:]
+    if constant:
+        slopes = Factor(Sxx).solve(Sxy)
+        return np.append(slopes, my - mx.dot(slopes))
+    return Factor(Sxx + cp.n * np.outer(mx, mx)).solve(Sxy + cp.n * mx * my)
+
+
+def ols(cp: CrossProducts, constant: bool = True, absorbed: int = 0) -> dict:
+    """
+    Least squares from the sufficient statistics in ``cp``
+
+    X'X is factored once; coefficients, the covariance matrix and the ANOVA
+    table are all read from that factor.  The constant, if any, is the last
+    coefficient.  absorbed is the number of degrees of freedom taken by
+    fixed effects partialled out of the data beforehand.
+    """
+    from scipy import special
+    n = cp.n
+    if n == 0:
+        raise RuntimeError('no observations')
+    # no residual degrees of freedom are left for the variance
+    if n <= len(cp.mean) - 1 + constant + absorbed:
+        raise RuntimeError('insufficient observations')
+    my, mx = cp.mean[0], cp.mean[1:]
+    Syy, Sxy, Sxx = cp.comoment[0, 0], cp.comoment[1:, 0], cp.comoment[1:, 1:]
+    if constant:
+        factor = Factor(Sxx)
+        slopes = factor.solve(Sxy)
+        inv_xx = factor.inv()
+        cons = my - mx.dot(slopes)
+        beta = np.append(slopes, cons)
+        shift = inv_xx.dot(mx)
+        inv = np.block([[inv_xx, -shift[:, None]],
+                        [-shift[None, :], np.array([[1 / n + mx.dot(shift)]])]])
+        SSE = Syy - slopes.dot(Sxy)
+    else:
+        Xty = Sxy + n * mx * my
+        factor = Factor(Sxx + n * np.outer(mx, mx))
+        slopes = factor.solve(Xty)
+        inv = factor.inv()
+        beta = slopes
+        SSE = Syy + n * my ** 2 - slopes.dot(Xty)
+    k = len(beta)
+    ret = dict()
+    # estimation
+    ret['beta'] = beta
+    # upperleft table
+    ret['SST'] = Syy
+    ret['SSR'] = slopes.dot(Sxx).dot(slopes)
+    ret['SSE'] = max(SSE, 0.0)
+    ret['df'] = (n - 1, k - 1, n - k - absorbed)
+    ret['MS'] = (ret['SST'] / ret['df'][0], ret['SSR'] / ret['df'][1], ret['SSE'] / ret['df'][2])
+    # bottom table
+    ret['XX_inv'] = inv
+    df_r = ret['df'][2]
+    sigma_sq = ret['SSE'] / df_r
+    ret['V'] = sigma_sq * inv
+    ret['std_err'] = np.sqrt(np.diag(ret['V']))
+    ret['t'] = ret['beta'] / ret['std_err']
+    ret['p'] = 2 * special.stdtr(df_r, -np.abs(ret['t']))
+    margin = special.stdtrit(df_r, 0.975) * ret['std_err']
+    ret['CI'] = (ret['beta'] - margin, ret['beta'] + margin)
+    # upperright table
+    ret['no_of_obs'] = n
+    ret['F_df'] = ret['df'][1:3]
+    ret['R_sq'] = ret['SSR'] / ret['SST']
+    ret['F'] = (ret['R_sq'] / ret['F_df'][0]) / ((1 - ret['R_sq']) / ret['F_df'][1])
+    ret['F_prob'] = special.fdtrc(ret['F_df'][0], ret['F_df'][1], ret['F'])
+    ret['adj_R_sq'] = 1 - (n - 1) / df_r * (1 - ret['R_sq'])
+    ret['MSE'] = np.sqrt(ret['MS'][2])
+    return ret
+
+
+class Scores:
+    """
+    Meat of the sandwich covariance of ols coefficients
+
+    The score of an observation is x_i e_i, its regressors times its
+    residual.  Unclustered, the meat is the sum of the outer products of
+    the scores; clustered, the scores are first summed within clusters,
+    given as integer codes, by one bincount per coefficient over each
+    block of rows, so no loop ever runs over the clusters.
+
+    An observation with analytic or sampling weight w has score w x_i e_i;
+    one with frequency weight f counts as f observations with the same
+    score, which are summed into the same cluster.
+    """
+    def __init__(self, beta: np.ndarray, constant: bool = True, clustered: bool = False,
+                 frequency: bool = False):
+        k = len(beta)
+        self.beta = beta
+        self.constant = constant
+        self.clustered = clustered
+        self.frequency = frequency
+        self.n = 0
+        self.meat = np.zeros((k, k))
+        self.sums = np.zeros((0, k))
+        self.counts = np.zeros(0)
+
+    def update(self, block: np.ndarray, codes: Optional[np.ndarray] = None,
+               weights: Optional[np.ndarray] = None):
+        """
+        Fold in rows of the dependent variable and the regressors, with
+        their cluster codes and weights
+        """
+        X = block[:, 1:]
+        if self.constant:
+            X = np.column_stack((X, np.ones(block.shape[0])))
+        scores = X * (block[:, 0] - X.dot(self.beta))[:, None]
+        if weights is None:
+            self.n += block.shape[0]
+        elif self.frequency:
+            self.n += weights.sum()
+        else:
+            self.n += np.count_nonzero(weights > 0)
+            scores *= weights[:, None]
+        if not self.clustered:
+            self.meat += (scores if weights is None or not self.frequency
+                          else scores * weights[:, None]).T.dot(scores)
+            return
+        if weights is not None and self.frequency:
+            scores *= weights[:, None]
+        G = int(codes.max()) + 1 if len(codes) else 0
+        if G > self.sums.shape[0]:
+            grow = max(G, 2 * self.sums.shape[0]) - self.sums.shape[0]
+            self.sums = np.vstack((self.sums, np.zeros((grow, self.sums.shape[1]))))
+            self.counts = np.append(self.counts, np.zeros(grow))
+        self.counts[:G] += np.bincount(codes, minlength=G)
+        for j in range(scores.shape[1]):
+            self.sums[:G, j] += np.bincount(codes, weights=scores[:, j], minlength=G)
+
+    def update_columns(self, columns: List[np.ndarray], codes: Optional[np.ndarray] = None,
+                       weights: Optional[np.ndarray] = None):
+        """update() over separate column arrays, skipping rows with a missing value or weight"""
+        if weights is not None:
+            columns = list(columns) + [weights]
+        n = len(columns[0]) if columns else 0
+        rows = observed(columns)
+        for start in range(0, n, BLOCK_ROWS):
+            block = np.column_stack([column[start:start + BLOCK_ROWS] for column in columns]).astype(float)
+            valid = rows[start:start + BLOCK_ROWS]
+            block = block[valid]
+            self.update(block if weights is None else block[:, :-1],
+                        None if codes is None else codes[start:start + BLOCK_ROWS][valid],
+                        None if weights is None else block[:, -1])
+
+    @property
+    def clusters(self) -> int:
+        return int(np.count_nonzero(self.counts))
+
+    def covariance(self, inv: np.ndarray, absorbed: int = 0) -> np.ndarray:
+        """
+        (X'X)^-1 M (X'X)^-1 with Stata's small-sample factor, n / (n - k), or
+        G / (G - 1) (n - 1) / (n - k) with G clusters; absorbed fixed
+        effects count towards k
+        """
+        n, k = self.n, len(self.beta) + absorbed
+        if self.clustered:
+            G = self.clusters
+            if G < 2:
+                raise RuntimeError('insufficient observations: fewer than 2 clusters')
+            meat = self.sums.T.dot(self.sums)
+            factor = G / (G - 1) * (n - 1) / (n - k)
+        else:
+            meat = self.meat
+            factor = n / (n - k)
+        return factor * inv.dot(meat).dot(inv)
+
+
+def robust_inference(ret: dict, V: np.ndarray, df_r: int, constant: bool = True) -> dict:
+    """
+    Replace the covariance in a result of ols, and the standard errors,
+    tests and intervals that follow from it; the model F test becomes the
+    Wald test that all slopes are zero, with df_r residual degrees of
+    freedom
+    """
+    from scipy import special
+    beta = ret['beta']
+    slopes = len(beta) - constant
+    ret['V'] = V
+    ret['std_err'] = np.sqrt(np.diag(V))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret['t'] = beta / ret['std_err']
+    ret['p'] = 2 * special.stdtr(df_r, -np.abs(ret['t']))
+    margin = special.stdtrit(df_r, 0.975) * ret['std_err']
+    ret['CI'] = (beta - margin, beta + margin)
+    # with fewer clusters than slopes the covariance of the slopes is
+    # singular, and Stata reports the F test as missing
+    if slopes > df_r or np.linalg.matrix_rank(V[:slopes, :slopes]) < slopes:
+        ret['F'] = np.nan
+    else:
+        try:
+            ret['F'] = beta[:slopes].dot(np.linalg.solve(V[:slopes, :slopes], beta[:slopes])) / slopes
+        except np.linalg.LinAlgError:
+            ret['F'] = np.nan
+    ret['F_df'] = (slopes, df_r)
+    ret['F_prob'] = special.fdtrc(slopes, df_r, ret['F'])
+    ret['df_r'] = df_r
+    return ret
+
+
+def batch_coefficients(n: np.ndarray, mean: np.ndarray, comoment: np.ndarray,
+                       constant: bool = True) -> np.ndarray:
+    """
+    coefficients() of a stack of cross products, one row per entry; an
+    entry without observations or with collinear regressors is a row of
+    missing values
+    """
+    m, k = mean.shape[0], mean.shape[1] - 1
+    my, mx = mean[:, 0], mean[:, 1:]
+    Sxy, Sxx = comoment[:, 1:, 0], comoment[:, 1:, 1:]
+    if not constant:
+        Sxy = Sxy + (n * my)[:, None] * mx
+        Sxx = Sxx + n[:, None, None] * mx[:, :, None] * mx[:, None, :]
+    diag = np.diagonal(Sxx, axis1=1, axis2=2)
+    ok = (n >= k + constant) & (diag > 0).all(axis=1)
+    scale = 1 / np.sqrt(np.where(ok[:, None], diag, 1.0))
+    A = Sxx * scale[:, :, None] * scale[:, None, :]
+    A[~ok] = np.eye(k)
+    try:
+        L = np.linalg.cholesky(A)
+    except np.linalg.LinAlgError:
+        # one entry that is not positive definite fails the whole stack
+        L = np.empty_like(A)
+        for i in range(m):
+            try:
+                L[i] = np.linalg.cholesky(A[i])
+            except np.linalg.LinAlgError:
+                ok[i] = False
+                A[i] = L[i] = np.eye(k)
+    ok &= np.diagonal(L, axis1=1, axis2=2).min(axis=1) ** 2 >= COLLINEARITY_TOL
+    A[~ok] = np.eye(k)
+    slopes = scale * np.linalg.solve(A, (scale * Sxy)[:, :, None])[:, :, 0]
+    beta = np.column_stack((slopes, my - (mx * slopes).sum(axis=1))) if constant else slopes
+    beta[~ok] = np.nan
+    return beta
+
+
+def shifted_sums(rows: np.ndarray, shift: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Count, sum and cross products of each row less shift, one entry per
+    row; rows with a missing value count for nothing
+    """
+    valid = ~np.isnan(rows).any(axis=1)
+    d = np.where(valid[:, None], rows - shift, 0.0)
+    return valid.astype(float), d, d[:, :, None] * d[:, None, :]
+
+
+def rolling_coefficients(Z: np.ndarray, window: int, recursive: bool = False,
+                         constant: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Observations used and coefficients of ols in every window of Z
+
+    Window j holds rows j to j + window - 1, or rows 0 to j + window - 1 if
+    recursive; a row with a missing value keeps its place in the window but
+    is not used.  Moving to the next window adds the row that enters to the
+    sums of the rows and of their cross products and subtracts the row that
+    leaves, so a window costs O(k^2) whatever its length.  The updates of a
+    block of windows are one cumulative sum, taken about the mean of the
+    window before the block; the sums are recomputed from the data every
+    window rows, so rounding errors of the downdates cannot build up.
+    """
+    rows, k = Z.shape
+    windows = max(rows - window + 1, 0)
+    count = np.zeros(windows)
+    beta = np.full((windows, k - 1 + constant), np.nan)
+    step = max(BLOCK_ROWS // k, 1)
+    # rows of window a except its last, rows a (0 if recursive) to
+    # a + window - 2, as their count, sum and cross products less shift
+    shift = np.zeros(k)
+    n0 = None
+    exact = 0
+    for a in range(0, windows, step):
+        b = min(a + step, windows)
+        if n0 is None or (not recursive and a - exact >= window):
+            before = Z[0 if recursive else a:a + window - 1]
+            valid = ~np.isnan(before).any(axis=1)
+            if valid.any():
+                shift = before[valid].mean(axis=0)
+            d = np.where(valid[:, None], before - shift, 0.0)
+            n0, s0, S0, exact = valid.sum(), d.sum(axis=0), d.T.dot(d), a
+        elif n0 > 0:
+            # move the shift to the current mean
+            delta = (shift + s0 / n0) - shift
+            shift = shift + delta
+            S0 = S0 - np.outer(s0, delta) - np.outer(delta, s0) + n0 * np.outer(delta, delta)
+            s0 = s0 - n0 * delta
+        # windows a to b - 1: rows a + window - 1 to b + window - 2 enter
+        # and, unless recursive, rows a to b - 2 leave
+        dn, ds, dS = shifted_sums(Z[a + window - 1:b + window - 1], shift)
+        if not recursive:
+            ln, ls, lS = shifted_sums(Z[a:b - 1], shift)
+            dn[1:] -= ln
+            ds[1:] -= ls
+            dS[1:] -= lS
+        n = n0 + np.cumsum(dn)
+        s = s0 + np.cumsum(ds, axis=0)
+        S = S0 + np.cumsum(dS, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offset = np.where(n[:, None] > 0, s / n[:, None], 0.0)
+        count[a:b] = n
+        beta[a:b] = batch_coefficients(n, shift + offset,
+                                       S - n[:, None, None] * offset[:, :, None] * offset[:, None, :], constant)
+        n0, s0, S0 = n[-1], s[-1], S[-1]
+        if not recursive:
+            # the last window less its first row, row b - 1
+            ln, ls, lS = shifted_sums(Z[b - 1:b], shift)
+            n0, s0, S0 = n0 - ln[0], s0 - ls[0], S0 - lS[0]
+    return count, beta
+
+
+def demean(Z: np.ndarray, groups: List[np.ndarray], weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Columns of Z less their projection on the indicators of every
+    fixed-effect dimension, each dimension given as integer group codes;
+    with weights, the projection and group means are weighted
+
+    Group means of one dimension after another are subtracted, by bincount
+    over the codes, until a sweep changes no column by more than DEMEAN_TOL
+    of its standard deviation (the method of alternating projections); one
+    dimension needs a single sweep.  No indicator column is ever formed.
+    """
+    Z = np.array(Z, dtype=float, order='F')
+    counts = [np.bincount(codes, weights=weights) for codes in groups]
+    for col in Z.T:
+        scale = max(col.std(), np.finfo(float).tiny)
+        for _ in range(DEMEAN_MAX_ITER):
+            change = 0.0
+            for codes, count in zip(groups, counts):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    means = np.bincount(codes, weights=col if weights is None else col * weights,
+                                        minlength=len(count)) / count
+                means[count == 0] = 0
+                col -= means[codes]
+                change = max(change, np.abs(means).max())
+            if len(groups) == 1 or change <= DEMEAN_TOL * scale:
+                break
+        else:
+            raise RuntimeError('fixed effects did not converge in %d iterations' % DEMEAN_MAX_ITER)
+    return Z
+
+
+def absorbed_rank(groups: List[np.ndarray]) -> int:
+    """
+    Number of linearly independent indicators of the fixed effects, the
+    constant included
+
+    The first two dimensions are counted exactly: their indicators are
+    dependent once per connected component of the graph linking the groups
+    that share observations.  Each further dimension is taken to lose one,
+    which can only overstate its degrees of freedom.
+    """
+    from scipy import sparse
+    from scipy.sparse import csgraph
+    sizes = [int(codes.max()) + 1 if len(codes) else 0 for codes in groups]
+    rank = sizes[0]
+    if len(groups) > 1:
+        links = sparse.coo_matrix((np.ones(len(groups[0])), (groups[0], sizes[0] + groups[1])),
+                                  shape=(sizes[0] + sizes[1],) * 2)
+        rank += sizes[1] - csgraph.connected_components(links, directed=False)[0]
+    return rank + sum(size - 1 for size in sizes[2:])
+
+
+def absorbed_fit(ret: dict, SST: float, SSE_pooled: float, rank: int) -> dict:
+    """
+    Fit statistics of the full model for a result of ols on demeaned data:
+    R-squared against the total sum of squares SST of the original
+    dependent variable, and the F test that all absorbed fixed effects are
+    zero, against the residuals SSE_pooled of the regression without them
+    """
+    from scipy import special
+    n, df_r = ret['no_of_obs'], ret['df'][2]
+    ret['R_sq_within'] = ret['R_sq']
+    ret['R_sq'] = 1 - ret['SSE'] / SST
+    ret['adj_R_sq'] = 1 - (n - 1) / df_r * (1 - ret['R_sq'])
+    ret['absorbed'] = rank
+    ret['F_absorb_df'] = (rank - 1, df_r)
+    ret['F_absorb'] = ((SSE_pooled - ret['SSE']) / (rank - 1)) / (ret['SSE'] / df_r) if rank > 1 else np.nan
+    ret['F_absorb_prob'] = special.fdtrc(rank - 1, df_r, ret['F_absorb'])
+    return ret
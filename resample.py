@@ -0,0 +1,367 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING
+import os
+import numpy as np
+import pandas as pd
+from funclib import regress
+from masks import observed
+from profiler import timed
+from regression import BLOCK_ROWS, COLLINEARITY_TOL, CrossProducts, coefficients, ols
+from util import *
+
+if TYPE_CHECKING:
+    from __init__ import StataPlatform
+
+
+# below this many resampled observations in total, replications run in
+# this process: starting a pool would cost more than it saves
+PARALLEL_MIN_WORK = 10 ** 6
+
+# shared memory blocks attached by this (worker) process, by name
+_attached = {}
+
+
+def estimation_sample(self: StataPlatform, command, keep_rows: bool = False) -> Tuple[np.ndarray, List[str], bool]:
+    """
+    Rows of the dependent variable and regressors used by a regress command,
+    as one contiguous array, with the coefficient names
+
+    With keep_rows, every observation in range keeps its row, and those
+    excluded by if or by a missing value are rows of missing values.
+    """
+    if self.handler(command.command) is not regress:
+        raise SyntaxError('%s is not supported after a replication prefix; only regress is' % command.command)
+    args, option = command.args, command.option
+    if 'using' in args:
+        raise SyntaxError('using not allowed')
+    if len(args) == 0:
+        raise SyntaxError('no variable provided')
+    if len(args) == 1:
+        raise SyntaxError('no independent variable provided')
+    for opt in option:
+        if opt != 'noconstant' or option.count(opt) > 1:
+            raise SyntaxError('option %s not allowed' % opt)
+    check_weight(command.weight)
+    data = split_data(self.data, command.in_, None if keep_rows else command.if_, None)
+    get_varlist(args, data)
+    columns = column_views(data, args)
+    if not keep_rows:
+        valid = observed(columns)
+        Z = np.column_stack([values[valid] for values in columns]).astype(float)
+    else:
+        Z = np.column_stack(columns).astype(float)
+        if command.if_ is not None:
+            Z[~evaluate_if(command.if_, data)] = np.nan
+    constant = 'noconstant' not in option
+    return Z, list(args) + (['_cons'] if constant else []), constant
+
+
+def bootstrap_block(Z: np.ndarray, seed: int, start: int, stop: int, constant: bool) -> np.ndarray:
+    """
+    Coefficients of bootstrap replications start to stop - 1, one row each;
+    a replication whose regressors are collinear is a row of missing values
+
+    Replication i draws from its own stream, SeedSequence(seed) spawned at
+    i, so the results do not depend on how replications are split up.
+    """
+    n, k = Z.shape
+    B = np.full((stop - start, k - 1 + constant), np.nan)
+    for i in range(start, stop):
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(i,)))
+        counts = np.bincount(rng.integers(0, n, n), minlength=n).astype(float)
+        cp = CrossProducts(k)
+        cp.update(Z, weights=counts)
+        try:
+            B[i - start] = coefficients(cp, constant)
+        except RuntimeError:
+            pass
+    return B
+
+
+def shared_block(name: str, shape: Tuple[int, int], seed: int, start: int, stop: int,
+                 constant: bool) -> np.ndarray:
+    """bootstrap_block run in a worker on the sample in shared memory"""
+    if name not in _attached:
+        # workers share the parent's resource tracker, so attaching does not
+        # make them owners of the block
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    Z = np.ndarray(shape, dtype=float, buffer=_attached[name].buf)
+    return bootstrap_block(Z, seed, start, stop, constant)
+
+
+def bootstrap_replicates(Z: np.ndarray, reps: int, seed: int, workers: int, constant: bool) -> np.ndarray:
+    """
+    Coefficients of reps bootstrap replications on a pool of workers
+
+    The sample is copied once into shared memory, which every worker maps,
+    instead of being pickled with each task.
+    """
+    if workers <= 1 or Z.shape[0] * reps < PARALLEL_MIN_WORK:
+        return bootstrap_block(Z, seed, 0, reps, constant)
+    memory = shared_memory.SharedMemory(create=True, size=max(Z.nbytes, 1))
+    try:
+        shared = np.ndarray(Z.shape, dtype=float, buffer=memory.buf)
+        shared[:] = Z
+        del shared
+        bounds = np.linspace(0, reps, min(reps, workers * 4) + 1).astype(int)
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(shared_block, memory.name, Z.shape, seed, int(a), int(b), constant)
+                       for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+            return np.vstack([future.result() for future in futures])
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def jackknife_replicates(Z: np.ndarray, coef: dict, constant: bool) -> CrossProducts:
+    """
+    Mean and centered cross products of the leave-one-out coefficients
+
+    Deleting observation i moves the coefficients by
+    (X'X)^-1 x_i e_i / (1 - h_i), where e_i is its residual and h_i its
+    leverage, so all n replications come from the full-sample fit in one
+    pass instead of n regressions.  Observations with a leverage of 1,
+    without which the regressors are collinear, give no replication.
+    """
+    b, inv = coef['beta'], coef['XX_inv']
+    replicates = CrossProducts(len(b))
+    for start in range(0, Z.shape[0], BLOCK_ROWS):
+        block = Z[start:start + BLOCK_ROWS]
+        X = np.column_stack((block[:, 1:], np.ones(block.shape[0]))) if constant else block[:, 1:]
+        e = block[:, 0] - X.dot(b)
+        XI = X.dot(inv)
+        keep = 1 - (XI * X).sum(axis=1)
+        valid = keep > COLLINEARITY_TOL
+        replicates.update(b - XI[valid] * (e[valid] / keep[valid])[:, None])
+    return replicates
+
+
+@timed('output')
+def display(coef: dict, names: List[str], kind: str, header: List[Tuple[str, str]], se: np.ndarray,
+            stat: np.ndarray, p: np.ndarray, CI: Tuple[np.ndarray, np.ndarray]):
+    print()
+    for i, (label, value) in enumerate(header):
+        print('%s%-18s= %10s' % (('Linear regression' if i == 0 else '').ljust(48), label, value))
+    print()
+    print('------------------------------------------------------------------------------')
+    if kind == 'bootstrap':
+        print('             |   Observed   Bootstrap                         Normal-based')
+        print('%s |      Coef.   Std. Err.      z    P>|z|     [95%% Conf. Interval]'
+              % parse_varname(names[0], length=12))
+    else:
+        print('             |              Jackknife')
+        print('%s |      Coef.   Std. Err.      t    P>|t|     [95%% Conf. Interval]'
+              % parse_varname(names[0], length=12))
+    print('-------------+----------------------------------------------------------------')
+    for i, varname in enumerate(names[1:]):
+        print('%s |   %s   %s   %6.2f   %.3f     %s    %s'
+              % (parse_varname(varname, length=12), parse_number(coef['beta'][i]),
+                 parse_number(se[i]), stat[i], p[i], parse_number(CI[0][i]), parse_number(CI[1][i])))
+    print('------------------------------------------------------------------------------')
+
+
+def wald(b: np.ndarray, V: np.ndarray) -> float:
+    """b' V^-1 b, missing if V is singular"""
+    try:
+        return float(b.dot(np.linalg.solve(V, b)))
+    except np.linalg.LinAlgError:
+        return np.nan
+
+
+def store_results(self: StataPlatform, coef: dict, names: List[str], kind: str, V: np.ndarray, reps: int,
+                  misreps: int, mean: np.ndarray):
+    self.e = {'cmd': 'regress', 'prefix': kind, 'vce': kind, 'depvar': names[0],
+              'N': int(coef['no_of_obs']), 'N_reps': reps - misreps, 'N_misreps': misreps,
+              'df_m': coef['df'][1], 'r2': coef['R_sq'], 'r2_a': coef['adj_R_sq'], 'rmse': coef['MSE'],
+              'b': pd.DataFrame([coef['beta']], index=['y1'], columns=names[1:]),
+              'V': pd.DataFrame(V, index=names[1:], columns=names[1:]),
+              'b_' + ('bs' if kind == 'bootstrap' else 'jk'): pd.DataFrame([mean], index=['y1'],
+                                                                           columns=names[1:])}
+
+
+def bootstrap(self: StataPlatform, args: List[str],
+              by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+              weight: Optional[str], option: List[str], command=None):
+    """
+Title
+
+    [R] bootstrap -- Bootstrap sampling and estimation
+
+
+Syntax
+
+        bootstrap [_b] [, options] : regress ...
+
+    options           Description
+    -------------------------------------------------------------------------
+    reps(#)           perform # bootstrap replications; default is reps(50)
+    seed(#)           set random-number seed to #
+    workers(#)        run replications on # processes; default is the
+                        number of CPUs
+    -------------------------------------------------------------------------
+
+
+    Replications are drawn from the estimation sample of regress.  Every
+    replication has its own random-number stream derived from seed(#), so
+    the results are the same whatever the number of workers.  The sample is
+    shared with the workers through shared memory.
+
+
+"""
+    reps = 50
+    seed = None
+    workers = os.cpu_count() or 1
+
+    def check_input():
+        nonlocal reps, seed, workers
+        for item in args:
+            if item != '_b':
+                raise SyntaxError('%s invalid; only _b may be bootstrapped' % item)
+        check_if(_if)
+        check_in(_in)
+        check_weight(weight)
+        for opt in option:
+            result = re.fullmatch(r'(reps|seed|workers)\((\d+)\)', opt)
+            if result is None:
+                raise SyntaxError('option %s not allowed' % opt)
+            value = int(result.group(2))
+            if result.group(1) == 'reps':
+                if value < 2:
+                    raise SyntaxError('reps() must be an integer greater than 1')
+                reps = value
+            elif result.group(1) == 'seed':
+                seed = value
+            else:
+                workers = max(value, 1)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+
+    def main():
+        try:
+            check_input()
+            Z, names, constant = estimation_sample(self, command)
+            cp = CrossProducts(Z.shape[1])
+            cp.update(Z)
+            coef = ols(cp, constant=constant)
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        except RuntimeError as e:
+            print_red(e.args)
+            return
+        if not self.quietly:
+            print('(running regress on estimation sample)')
+            print()
+            print('Bootstrap replications (%d)' % reps)
+        from scipy import special
+        B = bootstrap_replicates(Z, reps, seed, workers, constant)
+        B = B[~np.isnan(B).any(axis=1)]
+        misreps = reps - B.shape[0]
+        if B.shape[0] < 2:
+            print_red('insufficient observations to compute bootstrap standard errors')
+            return
+        V = np.atleast_2d(np.cov(B, rowvar=False))
+        se = np.sqrt(np.diag(V))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = coef['beta'] / se
+        p = 2 * special.ndtr(-np.abs(z))
+        margin = special.ndtri(0.975) * se
+        slopes = len(names) - 1 - constant
+        chi2 = wald(coef['beta'][:slopes], V[:slopes, :slopes])
+        store_results(self, coef, names, 'bootstrap', V, reps, misreps, B.mean(axis=0))
+        self.e.update({'chi2': chi2, 'seed': seed})
+        if self.quietly:
+            return
+        display(coef, names, 'bootstrap',
+                [('Number of obs', format(int(coef['no_of_obs']), ',')),
+                 ('Replications', format(reps - misreps, ',')),
+                 ('Wald chi2(%d)' % slopes, '%.2f' % chi2),
+                 ('Prob > chi2', '%.4f' % special.chdtrc(slopes, chi2)),
+                 ('R-squared', '%.4f' % coef['R_sq']),
+                 ('Adj R-squared', '%.4f' % coef['adj_R_sq']),
+                 ('Root MSE', '%.4f' % coef['MSE'])],
+                se, z, p, (coef['beta'] - margin, coef['beta'] + margin))
+        if misreps:
+            print('Note: One or more parameters could not be estimated in %d bootstrap replicates;' % misreps)
+            print('      standard-error estimates include only complete replications.')
+
+    main()
+
+
+def jackknife(self: StataPlatform, args: List[str],
+              by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+              weight: Optional[str], option: List[str], command=None):
+    """
+Title
+
+    [R] jackknife -- Jackknife estimation
+
+
+Syntax
+
+        jackknife [_b] : regress ...
+
+
+    Every replication leaves out one observation of the estimation sample of
+    regress.  The leave-one-out coefficients are computed from the full
+    sample fit with the deletion formula, in one pass over the data.
+
+
+"""
+    def check_input():
+        for item in args:
+            if item != '_b':
+                raise SyntaxError('%s invalid; only _b may be jackknifed' % item)
+        check_if(_if)
+        check_in(_in)
+        check_weight(weight)
+        check_option(option)
+
+    def main():
+        try:
+            check_input()
+            Z, names, constant = estimation_sample(self, command)
+            cp = CrossProducts(Z.shape[1])
+            cp.update(Z)
+            coef = ols(cp, constant=constant)
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        except RuntimeError as e:
+            print_red(e.args)
+            return
+        if not self.quietly:
+            print('(running regress on estimation sample)')
+            print()
+            print('Jackknife replications (%d)' % Z.shape[0])
+        from scipy import special
+        replicates = jackknife_replicates(Z, coef, constant)
+        m = replicates.n
+        if m < 2:
+            print_red('insufficient observations to compute jackknife standard errors')
+            return
+        V = (m - 1) / m * replicates.comoment
+        se = np.sqrt(np.diag(V))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = coef['beta'] / se
+        p = 2 * special.stdtr(m - 1, -np.abs(t))
+        margin = special.stdtrit(m - 1, 0.975) * se
+        slopes = len(names) - 1 - constant
+        F = wald(coef['beta'][:slopes], V[:slopes, :slopes]) / slopes if slopes else np.nan
+        store_results(self, coef, names, 'jackknife', V, Z.shape[0], Z.shape[0] - m, replicates.mean)
+        self.e.update({'F': F, 'df_r': m - 1})
+        if self.quietly:
+            return
+        display(coef, names, 'jackknife',
+                [('Number of obs', format(int(coef['no_of_obs']), ',')),
+                 ('Replications', format(m, ',')),
+                 ('F(%d, %d)' % (slopes, m - 1), '%.2f' % F),
+                 ('Prob > F', '%.4f' % special.fdtrc(slopes, m - 1, F)),
+                 ('R-squared', '%.4f' % coef['R_sq']),
+                 ('Adj R-squared', '%.4f' % coef['adj_R_sq']),
+                 ('Root MSE', '%.4f' % coef['MSE'])],
+                se, t, p, (coef['beta'] - margin, coef['beta'] + margin))
+
+    main()
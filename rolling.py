@@ -0,0 +1,123 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import numpy as np
+import pandas as pd
+import pyreadstat
+from profiler import timed
+from regression import rolling_coefficients
+from resample import estimation_sample
+from util import *
+
+if TYPE_CHECKING:
+    from __init__ import StataPlatform
+
+
+@timed('prep')
+def results_dataset(start: np.ndarray, end: np.ndarray, names: List[str], beta: np.ndarray) -> tuple:
+    """The dataset of rolling results: start, end and one _b_ variable per coefficient"""
+    columns = {'start': start.astype(np.int32), 'end': end.astype(np.int32)}
+    labels = ['first observation of the window', 'last observation of the window']
+    for i, var in enumerate(names):
+        columns['_b_' + var] = beta[:, i]
+        labels.append('_b[%s]' % var)
+    data = pd.DataFrame(columns)
+    meta = pyreadstat.metadata_container()
+    meta.column_names = list(data.columns)
+    meta.column_labels = labels
+    meta.column_names_to_labels = dict(zip(meta.column_names, labels))
+    meta.number_columns = data.shape[1]
+    meta.number_rows = data.shape[0]
+    meta.file_label = ''
+    return data, meta
+
+
+def rolling(self: StataPlatform, args: List[str],
+            by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+            weight: Optional[str], option: List[str], command=None):
+    """
+Title
+
+    [TS] rolling -- Rolling-window and recursive estimation
+
+
+Syntax
+
+        rolling [_b] , window(#) [options] : regress ...
+
+    options           Description
+    -------------------------------------------------------------------------
+    window(#)         number of consecutive observations in each window
+    recursive         use recursive windows, all starting at the first
+                        observation
+    clear             replace data in memory, even if the current data have
+                        not been saved to disk
+    -------------------------------------------------------------------------
+
+
+    The observations are taken in the order of the data in memory.  Window
+    j holds observations j to j + # - 1; those excluded by if or with a
+    missing value keep their place in the window but are not used.  The
+    data in memory are replaced by one observation per window holding its
+    first and last observation, start and end, and the coefficients
+    _b_varname and _b_cons.  Windows with fewer observations than
+    coefficients, or with collinear regressors, have missing coefficients.
+
+    The cross products of a window are those of the previous window with
+    the entering observation added and the leaving one taken out, so each
+    window costs the same whatever its length.
+
+
+"""
+    window = None
+    recursive = False
+
+    def check_input():
+        nonlocal window, recursive
+        for item in args:
+            if item != '_b':
+                raise SyntaxError('%s invalid; only _b may be collected' % item)
+        check_if(_if)
+        check_in(_in)
+        check_weight(weight)
+        for opt in option:
+            result = re.fullmatch(r'window\((\d+)\)', opt)
+            if result is not None:
+                window = int(result.group(1))
+                if window < 1:
+                    raise SyntaxError('window() must be a positive integer')
+            elif opt == 'recursive':
+                recursive = True
+            elif opt != 'clear' or option.count(opt) > 1:
+                raise SyntaxError('option %s not allowed' % opt)
+        if window is None:
+            raise SyntaxError('option window() required')
+        if self.globals.get('data_has_been_changed') and 'clear' not in option:
+            raise SyntaxError('no; data in memory would be lost')
+
+    def main():
+        try:
+            check_input()
+            Z, names, constant = estimation_sample(self, command, keep_rows=True)
+            if window > Z.shape[0]:
+                raise SyntaxError('window() must be no larger than the number of observations (%d)'
+                                  % Z.shape[0])
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        windows = Z.shape[0] - window + 1
+        if not self.quietly:
+            print()
+            print('Rolling replications (%d)' % windows)
+        count, beta = rolling_coefficients(Z, window, recursive, constant)
+        first = command.in_[0] + 1 if command.in_ is not None else 1
+        start = np.full(windows, first) if recursive else np.arange(windows) + first
+        self.data, self.meta = results_dataset(start, np.arange(windows) + first + window - 1, names[1:], beta)
+        self.data_changed()
+        if self.quietly:
+            return
+        missing = int(np.isnan(beta).any(axis=1).sum())
+        if missing:
+            print('(%d windows with too few observations or collinear regressors have missing coefficients)'
+                  % missing)
+
+    main()
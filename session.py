@@ -0,0 +1,282 @@
+from __future__ import annotations
+from sys import exit as sysexit
+from typing import TYPE_CHECKING, List, Optional, Tuple
+import os
+import re
+import time
+from console import *
+
+if TYPE_CHECKING:
+    from __init__ import StataPlatform
+
+
+def do(self: StataPlatform, args: List[str],
+       by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+       weight: Optional[str], option: List[str]):
+    """
+Title
+
+    [R] do -- Execute commands from a file
+
+
+Syntax
+
+        do filename [, timings(filename)]
+
+
+    Every command of the file is parsed before the first one runs; if any
+    line has a syntax error or names an unknown command, all such lines are
+    reported and nothing is executed.  The first command that reports an
+    error ends the do-file.  Lines starting with * and text after // or
+    inside /* */ are comments, and /// continues a command on the next
+    line.
+
+    timings(filename) writes the line number, wall-clock seconds and text of
+    every command executed to filename, one tab-separated line each.
+
+
+"""
+    def check_input():
+        # args
+        if len(args) > 1:
+            raise SyntaxError('invalid %s' % args[1])
+        elif len(args) == 0:
+            raise SyntaxError('invalid file specification')
+        check_by(by)
+        check_if(_if)
+        check_in(_in)
+        check_weight(weight)
+        # option
+        for i, opt in enumerate(option):
+            if i >= 1 or re.fullmatch(r'timings\(.+\)', opt) is None:
+                raise SyntaxError('option %s not allowed' % opt)
+
+    def main():
+        try:
+            check_input()
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        path = args[0].strip('"')
+        if not os.path.splitext(path)[1]:
+            path += '.do'
+        timings = option[0][len('timings('):-1].strip('"') if option else None
+        self.run_script(path, timings=timings)
+
+    main()
+
+
+def exit(self: StataPlatform, args: List[str],
+         by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+         weight: Optional[str], option: List[str]):
+    """
+Title
+
+    [R] exit -- Exit Stata
+
+
+Syntax
+
+        exit [, clear]
+
+
+"""
+
+    def check_input():
+        check_args(args)
+        check_by(by)
+        check_if(_if)
+        check_in(_in)
+        check_weight(weight)
+        # option
+        for i, item in enumerate(option):
+            if item != 'clear' or i >= 1:
+                raise SyntaxError('option %s not allowed' % item)
+        if self.globals.get('data_has_been_changed') and len(option) == 0:
+            raise SyntaxError('no, data in memory would be lost')
+
+    def main():
+        try:
+            check_input()
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        sysexit(0)
+
+    main()
+
+
+def set(self: StataPlatform, args: List[str],
+        by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+        weight: Optional[str], option: List[str]):
+    """
+Title
+
+    [R] set -- Overview of system parameters
+
+
+Syntax
+
+        set setting value
+
+
+    setting           Description
+    -------------------------------------------------------------------------
+    dtacache on|off   keep a memory-mapped columnar copy of every .dta file
+                        read in full, and reload from it while the file is
+                        unchanged
+    profile on|off    record the wall time of every command, split into
+                        parse, data preparation, compute and output, and
+                        its peak memory growth
+    profilelog filename|off
+                      also append every record to filename as a line of
+                        JSON
+    resultcache on|off
+                      replay the output and results of summarize, pwcorr,
+                        regress and areg run again with the same line on
+                        the same data, and reuse the missing-value masks
+                        of its columns; default is on.  Code changing
+                        platform.data in place must call
+                        platform.data_changed() while it is on
+    -------------------------------------------------------------------------
+
+
+"""
+    def check_input():
+        if len(args) == 0:
+            raise SyntaxError('set what?')
+        if args[0] not in ('dtacache', 'profile', 'profilelog', 'resultcache'):
+            raise SyntaxError('unrecognized command:  set %s' % args[0])
+        if len(args) != 2 or (args[0] != 'profilelog' and args[1] not in ('on', 'off')):
+            raise SyntaxError('invalid syntax')
+        check_by(by)
+        check_if(_if)
+        check_in(_in)
+        check_weight(weight)
+        check_option(option)
+
+    def main():
+        try:
+            check_input()
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        if args[0] == 'dtacache':
+            import dataset
+            dataset.settings['sidecar'] = args[1] == 'on'
+        elif args[0] == 'resultcache':
+            import masks
+            self.globals['resultcache'] = args[1] == 'on'
+            masks.settings['cache'] = args[1] == 'on'
+            if args[1] == 'off':
+                self.forget_results()
+                masks.cache_clear()
+        elif args[0] == 'profilelog':
+            self.globals['profilelog'] = None if args[1] == 'off' else args[1].strip('"')
+            if self.profiler is not None:
+                self.profiler.log = self.globals['profilelog']
+        elif args[1] == 'on' and self.profiler is None:
+            from profiler import Profiler
+            self.profiler = Profiler(log=self.globals.get('profilelog'))
+        elif args[1] == 'off' and self.profiler is not None:
+            self.profiler.close()
+            self.profiler = None
+
+    main()
+
+
+def timer(self: StataPlatform, args: List[str],
+          by: Optional[List[str]], _if: Optional[str], _in: Optional[Tuple[int, int]],
+          weight: Optional[str], option: List[str]):
+    """
+Title
+
+    [P] timer -- Time sections of code by recording and reporting time spent
+
+
+Syntax
+
+    Reset timers to zero
+
+        timer clear [#]
+
+
+    Turn a timer on
+
+        timer on #
+
+
+    Turn a timer off
+
+        timer off #
+
+
+    List the timings
+
+        timer list [#]
+
+
+    where # is an integer, 1 <= # <= 100.
+
+    timer list stores the total seconds and the number of times each timer
+    was turned off in r(t#) and r(nt#).
+
+
+"""
+    numbers = []
+
+    def check_input():
+        nonlocal numbers
+        if len(args) == 0 or args[0] not in ('clear', 'on', 'off', 'list'):
+            raise SyntaxError('invalid syntax')
+        if len(args) > 2 or (args[0] in ('on', 'off') and len(args) != 2):
+            raise SyntaxError('invalid syntax')
+        if len(args) == 2:
+            if not args[1].isdigit() or not 1 <= int(args[1]) <= 100:
+                raise SyntaxError('timer number must be between 1 and 100')
+            numbers = [int(args[1])]
+        check_by(by)
+        check_if(_if)
+        check_in(_in)
+        check_weight(weight)
+        check_option(option)
+
+    def main():
+        try:
+            check_input()
+        except SyntaxError as e:
+            print_red(e.msg)
+            return
+        now = time.perf_counter()
+        # every timer is [seconds, times turned off, when turned on or None]
+        if args[0] == 'on':
+            timer = self.timers.setdefault(numbers[0], [0.0, 0, None])
+            if timer[2] is not None:
+                print_red('timer %d already on' % numbers[0])
+                return
+            timer[2] = now
+        elif args[0] == 'off':
+            timer = self.timers.get(numbers[0])
+            if timer is None or timer[2] is None:
+                print_red('timer %d not on' % numbers[0])
+                return
+            timer[0] += now - timer[2]
+            timer[1] += 1
+            timer[2] = None
+        elif args[0] == 'clear':
+            for number in numbers or list(self.timers):
+                self.timers.pop(number, None)
+        else:
+            self.r = {}
+            for number in numbers or sorted(self.timers):
+                if number not in self.timers:
+                    continue
+                seconds, count, started = self.timers[number]
+                if started is not None:
+                    seconds += now - started
+                self.r['t%d' % number] = seconds
+                self.r['nt%d' % number] = count
+                if not self.quietly:
+                    print('%4d: %9.2f / %8d = %12.4f' % (number, seconds, count, seconds / max(count, 1)))
+
+    main()
@@ -1,10 +1,21 @@
-from typing import Union, List, Iterable, Tuple, Optional
-from pandas import DataFrame, Index
+from typing import Union, List, Iterable, Iterator, Tuple, Optional
+from pandas import DataFrame, Index, Series
+from console import check_args, check_by, check_if, check_in, check_option, check_weight, find_top_level, \
+    parse_weight, print_red
+from expression import compile_expression, evaluate_if, is_numeric, is_string, numeric_values
+from profiler import timed
+import numpy as np
+import pandas as pd
 import re
 
 
-def print_red(message):
-    print('\033[1;31m' + repr(message) + '\033[0m')
+# Stata storage types of readstat variable types and of NumPy dtypes
+FILE_TYPES = {'int8': 'byte', 'int16': 'int', 'int32': 'long', 'float': 'float', 'double': 'double'}
+DTYPE_TYPES = {'int8': 'byte', 'int16': 'int', 'int32': 'long', 'float32': 'float', 'float64': 'double'}
+TYPE_WIDTHS = {'byte': 1, 'int': 2, 'long': 4, 'float': 4, 'double': 8}
+READSTAT_TYPES = {type: name for name, type in FILE_TYPES.items()}
+# nonmissing range Stata stores in each integer type, smallest first
+INT_RANGES = (('byte', -127, 100), ('int', -32767, 32740), ('long', -2147483647, 2147483620))
 
 
 def parse_varname(name: str, length: int, pos='l') -> str:
@@ -15,6 +26,8 @@ def parse_varname(name: str, length: int, pos='l') -> str:
 
 
 def parse_number(number, length=8):
+    if np.isnan(number):
+        return '.'.rjust(length, ' ')
     if number < 0:
         return re.sub(r'-( +)', r'\1-', '-' + parse_number(abs(number), length=length-1))
     elif 0.1 < abs(number) < 1:
@@ -25,56 +38,195 @@ def parse_number(number, length=8):
         return ('%%%d.%dg' % (length, length - 1)) % number
 
 
+def storage_width(type: str) -> int:
+    if type.startswith('str'):
+        return int(type[3:])
+    return TYPE_WIDTHS.get(type, 8)
+
+
+def file_storage_types(meta) -> dict:
+    """Storage types declared in a .dta header, as Stata names them"""
+    types = {}
+    for var in meta.column_names:
+        type = meta.readstat_variable_types.get(var)
+        if type == 'string':
+            # readstat counts the terminating null in string widths
+            types[var] = 'str%d' % max(meta.variable_storage_width.get(var, 2) - 1, 1)
+        else:
+            types[var] = FILE_TYPES.get(type, type)
+    return types
+
+
+def storage_dtype(type: str, has_missing: bool) -> str:
+    """
+    NumPy dtype holding a numeric Stata storage type; integer types with
+    missing values are held in the narrowest float that represents them
+    exactly
+    """
+    if type in ('byte', 'int', 'long') and not has_missing:
+        return {'byte': 'int8', 'int': 'int16', 'long': 'int32'}[type]
+    return 'float32' if type in ('byte', 'int', 'float') else 'float64'
+
+
+def to_storage(data: Series, type: str) -> Series:
+    values = numeric_values(data)
+    dtype = storage_dtype(type, bool(np.isnan(values).any()))
+    return Series(values.astype(dtype), index=data.index, name=data.name, copy=False)
+
+
+def smallest_type(data: Series) -> str:
+    """Smallest numeric storage type holding every value of a column exactly"""
+    values = numeric_values(data)
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return 'byte'
+    lowest, highest = values.min(), values.max()
+    if np.all(values == np.floor(values)):
+        for type, low, high in INT_RANGES:
+            if low <= lowest and highest <= high:
+                return type
+    elif np.all(values.astype(np.float32) == values):
+        return 'float'
+    return 'double'
+
+
+def storage_type(data: Series, meta=None) -> str:
+    """Storage type of a column held in memory, read from its dtype"""
+    types = getattr(meta, 'readstat_variable_types', None) or {}
+    if is_numeric(data):
+        # a float may be holding an integer type that has missing values
+        type = FILE_TYPES.get(types.get(data.name))
+        if type is not None and data.dtype.name in (storage_dtype(type, False), storage_dtype(type, True)):
+            return type
+        return DTYPE_TYPES.get(data.dtype.name, 'double' if data.dtype.kind == 'O' else data.dtype.name)
+    if data.name in types:
+        return file_storage_types(meta)[data.name]
+    lengths = data.str.len()
+    return 'str%d' % max(int(lengths.max()) if lengths.notna().any() else 1, 1)
+
+
+def column_nbytes(data: Series, type: str) -> int:
+    if data.dtype.kind in 'biuf':
+        return data.nbytes
+    return data.shape[0] * storage_width(type)
+
+
+def parse_stat(number: float, length=9) -> str:
+    if np.isnan(number):
+        return '.'.rjust(length, ' ')
+    return ('%%%d.4f' % length) % number
+
+
 def get_varlist(vars: List[str], data: DataFrame) -> Union[List[str], Index]:
     if vars:
-        try:
-            _ = [data[arg] for arg in vars]
-            return vars
-        except ValueError as e:
-            raise SyntaxError('variable %s not found' % e.args[0][:e.args[0].index(' ')])
+        for arg in vars:
+            if arg not in data.columns:
+                raise SyntaxError('variable %s not found' % arg)
+        return vars
     return data.columns
 
 
-def check_args(args: List[str]):
-    if args:
-        raise SyntaxError('%s not allowed' % args[0])
-
-
-def check_by(by: Optional[List[str]]):
-    if by is not None:
-        raise SyntaxError(' may not be combined with by')
-
-
-def check_if(_if: Optional[str]):
-    if _if is not None:
-        raise SyntaxError('if not allowed')
-
-
-def check_in(_in: Optional[Tuple[int, int]]):
-    if _in is not None:
-        raise SyntaxError('in range not allowed')
-
-
-def check_weight(weight: Optional[str]):
-    if weight is not None:
-        raise SyntaxError('weights not allowed')
-
-
-def check_option(option: List[str]):
-    if option:
-        raise SyntaxError('option %s not allowed' % option[0])
-
-
+class Groups:
+    """
+    Observations of a dataset partitioned by the values of a by varlist
+
+    The key columns are factorized and the rows stably sorted by group once;
+    every group is then a contiguous slice of that order, so commands can
+    run on all groups without filtering the data again for each of them.
+    """
+    def __init__(self, data: DataFrame, by: List[str]):
+        for var in by:
+            if var not in data.columns:
+                raise SyntaxError('variable %s not found' % var)
+        codes = np.zeros(data.shape[0], dtype=np.int64)
+        for var in by:
+            values = numeric_values(data[var])
+            values = data[var] if values is None else values
+            var_codes, uniques = pd.factorize(values, sort=True, use_na_sentinel=False)
+            codes, _ = pd.factorize(codes * len(uniques) + var_codes, sort=True)
+        self.data = data
+        self.by = by
+        self.codes = codes
+        self.order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes)
+        self.bounds = np.concatenate(([0], np.cumsum(counts)))
+        self.keys = data[by].iloc[self.order[self.bounds[:-1]]].reset_index(drop=True)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def slices(self, columns: Iterable[str]) -> Iterator[Tuple[int, DataFrame]]:
+        data = self.data[list(columns)].take(self.order)
+        for g in range(len(self)):
+            yield g, data.iloc[self.bounds[g]:self.bounds[g + 1]]
+
+    def label(self, g: int, value_labels: Optional[dict] = None) -> str:
+        items = []
+        for var in self.by:
+            value = self.keys[var][g]
+            labels = (value_labels or {}).get(var, {})
+            if value in labels:
+                value = labels[value]
+            elif isinstance(value, str):
+                pass
+            elif pd.isna(value):
+                value = '.'
+            elif float(value).is_integer():
+                value = '%d' % value
+            else:
+                value = '%g' % value
+            items.append('%s = %s' % (var, value))
+        return ', '.join(items)
+
+
+def print_by_header(label: str):
+    print('-' * 79)
+    print('-> ' + label)
+    print()
+
+
+def column_views(data: DataFrame, varlist: Iterable[str]) -> List[np.ndarray]:
+    """The arrays behind numeric columns, without copying them when possible"""
+    views = []
+    for var in varlist:
+        values = data[var]
+        view = values.to_numpy(copy=False) if values.dtype.kind in 'biuf' else numeric_values(values)
+        if view is None:
+            raise SyntaxError('type mismatch')
+        views.append(view)
+    return views
+
+
+def weight_variables(weight: Optional[Tuple[str, str]], data: DataFrame) -> List[str]:
+    """Variables the weight expression refers to"""
+    return [] if weight is None else compile_expression(weight[1], data).variables
+
+
+def weight_values(weight: Tuple[str, str], data: DataFrame) -> np.ndarray:
+    """
+    Values of the weight expression; a missing weight is NaN, so that its
+    observation is dropped like one with a missing value
+    """
+    values = compile_expression(weight[1], data)(data)
+    if is_string(values):
+        raise SyntaxError('type mismatch')
+    values = np.broadcast_to(np.asarray(values, dtype=float), (data.shape[0],))
+    given = values[~np.isnan(values)]
+    if (given < 0).any():
+        raise SyntaxError('negative weights encountered')
+    if weight[0] == 'fweight' and (given != np.floor(given)).any():
+        raise SyntaxError('may not use noninteger frequency weights')
+    return values
+
+
+@timed('prep')
 def split_data(data: DataFrame, _in: Optional[Tuple[int, int]],
                _if: Optional[str], by: Optional[List[str]]) \
-        -> Union[DataFrame, Iterable[DataFrame]]:
+        -> Union[DataFrame, Groups]:
     if _in is not None:
         data = data[_in[0]:_in[1]]
     if _if is not None:
-        pass
+        data = data[evaluate_if(_if, data)]
     if by is not None:
-        pass
+        return Groups(data, by)
     return data
-
-
-